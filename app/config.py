@@ -20,6 +20,8 @@ FIREBASE_UNIVERSE_DOMAIN = os.getenv("FIREBASE_UNIVERSE_DOMAIN")
 
 FIREBASE_WEB_API_KEY = os.getenv("FIREBASE_WEB_API_KEY", "")
 ENABLE_FIRESTORE_PROVISIONING = os.getenv("ENABLE_FIRESTORE_PROVISIONING", "true").lower() == "true"
+# Lecturas desde la vista desnormalizada `principals` (correr app.scripts.rebuild_principals antes de activar)
+USE_PRINCIPALS_VIEW = os.getenv("USE_PRINCIPALS_VIEW", "false").lower() == "true"
 
 SESSION_COOKIE_NAME = os.getenv("SESSION_COOKIE_NAME", "__session")
 SESSION_EXPIRES_HOURS = int(os.getenv("SESSION_EXPIRES_HOURS", "12"))
@@ -27,3 +29,67 @@ SESSION_COOKIE_DOMAIN = os.getenv("SESSION_COOKIE_DOMAIN") or None
 SESSION_COOKIE_SECURE = os.getenv("SESSION_COOKIE_SECURE", "false").lower() == "true"
 
 SESSION_EXPIRES_DELTA = timedelta(hours=SESSION_EXPIRES_HOURS)
+
+# Borrado de cuentas en background (DELETE /users/me)
+DELETION_MAX_ATTEMPTS = int(os.getenv("DELETION_MAX_ATTEMPTS", "5"))
+# Lease de un job tomado por un worker y barrido periódico de jobs pendientes/fallidos/abandonados
+DELETION_LEASE_SECONDS = int(os.getenv("DELETION_LEASE_SECONDS", "120"))
+DELETION_SWEEP_INTERVAL_SECONDS = int(os.getenv("DELETION_SWEEP_INTERVAL_SECONDS", "300"))
+DELETION_REDRIVE_MAX_DELAY_SECONDS = int(os.getenv("DELETION_REDRIVE_MAX_DELAY_SECONDS", "3600"))
+
+# Caché de dos niveles (L1 en proceso, L2 compartido). CACHE_BACKEND=fake usa un L2 en memoria (tests)
+REDIS_URL = os.getenv("REDIS_URL", "")
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "redis" if REDIS_URL else "memory").lower()
+CACHE_L1_TTL_SECONDS = int(os.getenv("CACHE_L1_TTL_SECONDS", "30"))
+CACHE_L2_TTL_SECONDS = int(os.getenv("CACHE_L2_TTL_SECONDS", "300"))
+CACHE_L1_MAX_ENTRIES = int(os.getenv("CACHE_L1_MAX_ENTRIES", "10000"))
+# Roles (autorización) con TTL corto; tombstone en L2 tras invalidar (mayor que la lectura más lenta)
+CACHE_ROLES_L1_TTL_SECONDS = int(os.getenv("CACHE_ROLES_L1_TTL_SECONDS", "5"))
+CACHE_ROLES_L2_TTL_SECONDS = int(os.getenv("CACHE_ROLES_L2_TTL_SECONDS", "60"))
+CACHE_INVALIDATION_GRACE_SECONDS = int(os.getenv("CACHE_INVALIDATION_GRACE_SECONDS", "10"))
+# Fingerprints del ETag de GET /users: se reusan hasta este TTL si no hubo invalidaciones
+CACHE_FINGERPRINT_TTL_SECONDS = int(os.getenv("CACHE_FINGERPRINT_TTL_SECONDS", "5"))
+
+# Trazado por request (header X-Debug-Trace, solo platform_admin). Log JSON opcional y muestreado
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "")
+TRACE_LOG_SAMPLE_RATE = float(os.getenv("TRACE_LOG_SAMPLE_RATE", "1.0"))
+
+# Export en streaming de usuarios (tamaño de página de Firestore)
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "500"))
+
+# Delta sync (/users/changes): solapamiento del watermark para no perder commits concurrentes
+SYNC_OVERLAP_SECONDS = int(os.getenv("SYNC_OVERLAP_SECONDS", "5"))
+
+# Control de admisión por grupo de rutas (concurrencia 0 = sin límite)
+ADMISSION_HEAVY_CONCURRENCY = int(os.getenv("ADMISSION_HEAVY_CONCURRENCY", "4"))
+ADMISSION_HEAVY_QUEUE = int(os.getenv("ADMISSION_HEAVY_QUEUE", "16"))
+ADMISSION_HEAVY_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_HEAVY_TIMEOUT_SECONDS", "5"))
+ADMISSION_DEFAULT_CONCURRENCY = int(os.getenv("ADMISSION_DEFAULT_CONCURRENCY", "0"))
+ADMISSION_DEFAULT_QUEUE = int(os.getenv("ADMISSION_DEFAULT_QUEUE", "100"))
+ADMISSION_DEFAULT_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_DEFAULT_TIMEOUT_SECONDS", "2"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "2"))
+
+# Audit log de cambios de roles (buffer en memoria, flush por tamaño o intervalo)
+AUDIT_MAX_BUFFER = int(os.getenv("AUDIT_MAX_BUFFER", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_INTERVAL_SECONDS = float(os.getenv("AUDIT_FLUSH_INTERVAL_SECONDS", "2"))
+AUDIT_ENQUEUE_TIMEOUT_SECONDS = float(os.getenv("AUDIT_ENQUEUE_TIMEOUT_SECONDS", "0.5"))
+
+# Claves públicas de Google precargadas/refrescadas en background para verificar tokens
+KEY_MANAGER_ENABLED = os.getenv("KEY_MANAGER_ENABLED", "true").lower() == "true"
+KEY_REFRESH_MARGIN_SECONDS = int(os.getenv("KEY_REFRESH_MARGIN_SECONDS", "600"))
+
+# Compresión de respuestas (brotli si está brotli-asgi, si no gzip) a partir de este tamaño en bytes
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+
+# Importación CSV: escrituras por batch (máx. 500) y batches commiteados en paralelo
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "450"))
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "8"))
+
+# Renovación deslizante de la session cookie: se re-emite si le quedan menos de
+# SESSION_RENEW_WINDOW_MINUTES, como mucho una vez cada SESSION_RENEW_MIN_INTERVAL_SECONDS
+# por uid y sin pasar de SESSION_RENEW_MAX_HOURS desde el login original
+SESSION_RENEW_ENABLED = os.getenv("SESSION_RENEW_ENABLED", "false").lower() == "true"
+SESSION_RENEW_WINDOW_MINUTES = int(os.getenv("SESSION_RENEW_WINDOW_MINUTES", "120"))
+SESSION_RENEW_MIN_INTERVAL_SECONDS = int(os.getenv("SESSION_RENEW_MIN_INTERVAL_SECONDS", "300"))
+SESSION_RENEW_MAX_HOURS = int(os.getenv("SESSION_RENEW_MAX_HOURS", "168"))
@@ -0,0 +1,160 @@
+"""
+Control de admisión por grupo de rutas (bulkheads).
+
+Los endpoints caros (listados completos, export, búsqueda, importación, operaciones de roles)
+comparten el threadpool con los baratos (/health, /users/me, login). Cada grupo
+tiene su límite de concurrencia y una cola acotada con timeout; si se excede se
+rechaza con 429 (cola llena) o 503 (timeout en cola) y `Retry-After`.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+from app.config import (
+    ADMISSION_HEAVY_CONCURRENCY,
+    ADMISSION_HEAVY_QUEUE,
+    ADMISSION_HEAVY_TIMEOUT_SECONDS,
+    ADMISSION_DEFAULT_CONCURRENCY,
+    ADMISSION_DEFAULT_QUEUE,
+    ADMISSION_DEFAULT_TIMEOUT_SECONDS,
+    ADMISSION_RETRY_AFTER_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Nunca se limitan (probes y métricas)
+EXEMPT_PATHS = {"/health", "/health/admission"}
+
+# (método, path, es_prefijo) -> grupo "heavy"; el resto cae en "default"
+HEAVY_ROUTES: List[Tuple[str, str, bool]] = [
+    ("GET", "/users", False),
+    ("GET", "/users/export", False),
+    ("GET", "/users/search", False),
+    ("GET", "/users/changes", False),
+    ("POST", "/users/roles/", True),
+    ("POST", "/users/import", False),
+    ("POST", "/careers/import", False),
+]
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+
+class Bulkhead:
+    """
+    Semáforo con cola acotada. `max_concurrent <= 0` desactiva el límite.
+    """
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._sem: Optional[asyncio.Semaphore] = (
+            asyncio.Semaphore(max_concurrent) if max_concurrent > 0 else None
+        )
+        self.in_flight = 0
+        self.queued = 0
+        self.stats = {
+            "admitted": 0,
+            "rejected_queue_full": 0,
+            "rejected_timeout": 0,
+            "peak_in_flight": 0,
+            "peak_queued": 0,
+        }
+
+    async def acquire(self) -> None:
+        if self._sem is not None:
+            if self._sem.locked():
+                if self.queued >= self.max_queue:
+                    self.stats["rejected_queue_full"] += 1
+                    raise Rejected(429, "cola llena")
+                self.queued += 1
+                self.stats["peak_queued"] = max(self.stats["peak_queued"], self.queued)
+                try:
+                    await asyncio.wait_for(self._sem.acquire(), timeout=self.queue_timeout)
+                except asyncio.TimeoutError:
+                    self.stats["rejected_timeout"] += 1
+                    raise Rejected(503, "timeout en cola")
+                finally:
+                    self.queued -= 1
+            else:
+                await self._sem.acquire()
+        self.in_flight += 1
+        self.stats["admitted"] += 1
+        self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.in_flight)
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        if self._sem is not None:
+            self._sem.release()
+
+    def snapshot(self) -> Dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "queue_timeout_seconds": self.queue_timeout,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            **self.stats,
+        }
+
+BULKHEADS: Dict[str, Bulkhead] = {
+    "heavy": Bulkhead(
+        "heavy", ADMISSION_HEAVY_CONCURRENCY, ADMISSION_HEAVY_QUEUE, ADMISSION_HEAVY_TIMEOUT_SECONDS
+    ),
+    "default": Bulkhead(
+        "default", ADMISSION_DEFAULT_CONCURRENCY, ADMISSION_DEFAULT_QUEUE, ADMISSION_DEFAULT_TIMEOUT_SECONDS
+    ),
+}
+
+def route_group(method: str, path: str) -> Optional[str]:
+    if path in EXEMPT_PATHS or method == "OPTIONS":
+        return None
+    path = path.rstrip("/") or "/"
+    for m, p, prefix in HEAVY_ROUTES:
+        if method != m:
+            continue
+        if (prefix and (path + "/").startswith(p)) or path == p:
+            return "heavy"
+    return "default"
+
+def admission_stats() -> Dict[str, Dict]:
+    return {name: b.snapshot() for name, b in BULKHEADS.items()}
+
+class AdmissionMiddleware:
+    """
+    Middleware ASGI: reserva un cupo del bulkhead del grupo durante todo el request
+    (incluido el envío del body en respuestas en streaming).
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        group = route_group(scope.get("method", ""), scope.get("path", ""))
+        if group is None:
+            await self.app(scope, receive, send)
+            return
+
+        bulkhead = BULKHEADS[group]
+        try:
+            await bulkhead.acquire()
+        except Rejected as e:
+            logger.warning("admisión rechazada (%s, %s): %s", group, scope.get("path"), e.reason)
+            response = JSONResponse(
+                {"detail": f"Servicio saturado ({e.reason}), reintenta más tarde."},
+                status_code=e.status_code,
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER_SECONDS)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            bulkhead.release()
@@ -0,0 +1,337 @@
+"""
+Caché de dos niveles para tokens verificados, roles y perfiles.
+
+- L1: dict en proceso con TTL corto (por worker).
+- L2: store compartido entre workers/pods (Redis si hay REDIS_URL; un fake en memoria
+  para tests con CACHE_BACKEND=fake). Sin L2 solo se usa L1.
+
+Las escrituras llaman a `invalidate`, que deja un tombstone corto en L2 y publica el
+evento por pub/sub para que el resto de workers descarte su L1. Una lectura que empezó
+antes de la invalidación no re-puebla la caché con el valor viejo: en L1 se compara la
+generación de la clave y en L2 se escribe solo si la clave está libre (el tombstone la ocupa).
+"""
+import copy
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.config import (
+    REDIS_URL,
+    CACHE_BACKEND,
+    CACHE_L1_TTL_SECONDS,
+    CACHE_L2_TTL_SECONDS,
+    CACHE_L1_MAX_ENTRIES,
+    CACHE_ROLES_L1_TTL_SECONDS,
+    CACHE_ROLES_L2_TTL_SECONDS,
+    CACHE_INVALIDATION_GRACE_SECONDS,
+)
+
+try:
+    import redis  # opcional
+except ImportError:  # pragma: no cover
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "auth-cache:invalidate"
+
+# Valor en L2 de una clave recién invalidada (bloquea re-poblarla con datos viejos)
+TOMBSTONE = "__invalidated__"
+
+# ====== SERIALIZACIÓN L2 ======
+def _default(o):
+    if isinstance(o, datetime):
+        return {"__dt__": o.isoformat()}
+    raise TypeError(f"no serializable: {type(o).__name__}")
+
+def _hook(d):
+    if len(d) == 1 and "__dt__" in d:
+        return datetime.fromisoformat(d["__dt__"])
+    return d
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, default=_default)
+
+def _loads(raw) -> Any:
+    return json.loads(raw, object_hook=_hook)
+
+# ====== L1 ======
+class LocalCache:
+    """
+    Dict con TTL y tamaño máximo (descarta las entradas más viejas al llenarse).
+    """
+    def __init__(self, max_entries: int = CACHE_L1_MAX_ENTRIES):
+        self._data: Dict[str, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+        self._max = max_entries
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                self._data.pop(key, None)
+                return None
+            return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            if len(self._data) >= self._max and key not in self._data:
+                # dict conserva orden de inserción: el primero es el más viejo
+                self._data.pop(next(iter(self._data)))
+            self._data[key] = (time.monotonic() + ttl, value)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+# ====== L2 ======
+class FakeSharedStore:
+    """
+    Sustituto en memoria de Redis (get/set con TTL/delete/publish) para tests y desarrollo.
+    Una sola instancia por proceso simula el store compartido entre "workers".
+    """
+    def __init__(self):
+        self._data: Dict[str, Tuple[float, str]] = {}
+        self._subscribers: List[Callable[[str], None]] = []
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                self._data.pop(key, None)
+                return None
+            return item[1]
+
+    def set(self, key: str, raw: str, ttl: int) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, raw)
+
+    def add(self, key: str, raw: str, ttl: int) -> bool:
+        """
+        Escribe solo si la clave no existe (como SET NX).
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] >= time.monotonic():
+                return False
+            self._data[key] = (time.monotonic() + ttl, raw)
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def publish(self, message: str) -> None:
+        for cb in list(self._subscribers):
+            cb(message)
+
+    def subscribe(self, callback: Callable[[str], None]) -> None:
+        self._subscribers.append(callback)
+
+class RedisStore:
+    def __init__(self, url: str):
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, key: str) -> Optional[str]:
+        return self._client.get(key)
+
+    def set(self, key: str, raw: str, ttl: int) -> None:
+        self._client.set(key, raw, ex=max(1, int(ttl)))
+
+    def add(self, key: str, raw: str, ttl: int) -> bool:
+        return bool(self._client.set(key, raw, ex=max(1, int(ttl)), nx=True))
+
+    def delete(self, key: str) -> None:
+        self._client.delete(key)
+
+    def publish(self, message: str) -> None:
+        self._client.publish(INVALIDATION_CHANNEL, message)
+
+    def subscribe(self, callback: Callable[[str], None]) -> None:
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{INVALIDATION_CHANNEL: lambda msg: callback(msg["data"])})
+        pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+def _build_store():
+    if CACHE_BACKEND == "fake":
+        return FakeSharedStore()
+    if REDIS_URL:
+        if redis is None:
+            logger.warning("REDIS_URL definido pero el paquete `redis` no está instalado; solo L1")
+            return None
+        return RedisStore(REDIS_URL)
+    return None
+
+# Invalidaciones vistas por este proceso (cualquier caché, locales o por pub/sub):
+# lo derivado de varias claves (p.ej. fingerprints de colecciones) se descarta si cambia
+_invalidations = 0
+_invalidations_lock = threading.Lock()
+
+def _count_invalidation() -> None:
+    global _invalidations
+    with _invalidations_lock:
+        _invalidations += 1
+
+def invalidation_count() -> int:
+    with _invalidations_lock:
+        return _invalidations
+
+# ====== CACHÉ DE DOS NIVELES ======
+class TwoLevelCache:
+    def __init__(self, namespace: str, store=None,
+                 l1_ttl: int = CACHE_L1_TTL_SECONDS, l2_ttl: int = CACHE_L2_TTL_SECONDS):
+        self.namespace = namespace
+        self.store = store
+        self.l1 = LocalCache()
+        self.l1_ttl = l1_ttl
+        self.l2_ttl = l2_ttl
+        # Generación por clave: sube con cada invalidación (local o recibida por pub/sub)
+        self._generations: Dict[str, int] = {}
+        self._gen_lock = threading.Lock()
+        self.stats = {"l1_hits": 0, "l2_hits": 0, "misses": 0, "errors": 0, "stale_loads": 0}
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def get(self, key: str):
+        value = self.l1.get(key)
+        if value is not None:
+            self.stats["l1_hits"] += 1
+            return copy.deepcopy(value)
+        if self.store is not None:
+            try:
+                raw = self.store.get(self._key(key))
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning("cache L2 get falló (%s): %s", self.namespace, e)
+                raw = None
+            if raw is not None and raw != TOMBSTONE:
+                value = _loads(raw)
+                self.l1.set(key, value, self.l1_ttl)
+                self.stats["l2_hits"] += 1
+                return copy.deepcopy(value)
+        self.stats["misses"] += 1
+        return None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        if value is None:
+            return
+        self.l1.set(key, copy.deepcopy(value), min(self.l1_ttl, ttl) if ttl else self.l1_ttl)
+        if self.store is not None:
+            try:
+                self.store.set(self._key(key), _dumps(value), min(self.l2_ttl, ttl) if ttl else self.l2_ttl)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning("cache L2 set falló (%s): %s", self.namespace, e)
+
+    def generation(self, key: str) -> int:
+        with self._gen_lock:
+            return self._generations.get(key, 0)
+
+    def _bump(self, key: str) -> None:
+        with self._gen_lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+        _count_invalidation()
+        self.l1.delete(key)
+
+    def get_or_load(self, key: str, loader: Callable[[], Any], ttl: Optional[float] = None):
+        value = self.get(key)
+        if value is not None:
+            return value
+        gen = self.generation(key)
+        value = loader()
+        if value is None:
+            return value
+        if self.generation(key) != gen:
+            # Se invalidó mientras cargábamos: el valor puede ser viejo, no se cachea
+            self.stats["stale_loads"] += 1
+            return value
+        self.l1.set(key, copy.deepcopy(value), min(self.l1_ttl, ttl) if ttl else self.l1_ttl)
+        if self.store is not None:
+            try:
+                # Solo si la clave está libre: no pisa un tombstone ni un valor más nuevo
+                self.store.add(self._key(key), _dumps(value), min(self.l2_ttl, ttl) if ttl else self.l2_ttl)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning("cache L2 add falló (%s): %s", self.namespace, e)
+        return value
+
+    def invalidate(self, key: str) -> None:
+        self._bump(key)
+        if self.store is not None:
+            try:
+                self.store.set(self._key(key), TOMBSTONE, CACHE_INVALIDATION_GRACE_SECONDS)
+                self.store.publish(self._key(key))
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning("cache L2 invalidate falló (%s): %s", self.namespace, e)
+
+# ====== MARCAS CON TTL EXACTO ======
+class TTLMarks:
+    """
+    Marcas por clave con el TTL pedido (sin los topes de L1/L2 de TwoLevelCache), para
+    rate limits. L1 local + store compartido si hay.
+    """
+    def __init__(self, namespace: str, store=None):
+        self.namespace = namespace
+        self.store = store
+        self.local = LocalCache()
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def is_set(self, key: str) -> bool:
+        if self.local.get(key) is not None:
+            return True
+        if self.store is None:
+            return False
+        try:
+            return self.store.get(self._key(key)) is not None
+        except Exception as e:
+            logger.warning("marca L2 get falló (%s): %s", self.namespace, e)
+            return False
+
+    def set(self, key: str, ttl: float) -> None:
+        self.local.set(key, True, ttl)
+        if self.store is not None:
+            try:
+                self.store.set(self._key(key), "1", ttl)
+            except Exception as e:
+                logger.warning("marca L2 set falló (%s): %s", self.namespace, e)
+
+_store = _build_store()
+
+token_cache = TwoLevelCache("token", _store)
+# Roles = autorización: TTLs cortos (sin L2 no hay invalidación entre workers)
+roles_cache = TwoLevelCache("roles", _store, l1_ttl=CACHE_ROLES_L1_TTL_SECONDS, l2_ttl=CACHE_ROLES_L2_TTL_SECONDS)
+profile_cache = TwoLevelCache("profile", _store)
+# Marca por uid de la última renovación de sesión (rate limit compartido entre workers)
+session_renew_marks = TTLMarks("session_renew", _store)
+
+_caches = {c.namespace: c for c in (token_cache, roles_cache, profile_cache)}
+
+def _on_invalidation(message: str) -> None:
+    namespace, _, key = message.partition(":")
+    cache = _caches.get(namespace)
+    if cache is not None:
+        cache._bump(key)
+
+if _store is not None:
+    try:
+        _store.subscribe(_on_invalidation)
+    except Exception as e:
+        logger.warning("no se pudo suscribir a invalidaciones de caché: %s", e)
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    return {name: dict(c.stats) for name, c in _caches.items()}
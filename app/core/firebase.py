@@ -1,6 +1,7 @@
 import firebase_admin
 from firebase_admin import credentials, auth, firestore as admin_fs
 
+from app.core.tracing import traced_client
 from app.config import (
     FIREBASE_TYPE,
     FIREBASE_PROJECT_ID,
@@ -39,4 +40,4 @@ if not firebase_admin._apps:
 
 # Clientes globales
 firebase_auth = auth
-firestore_db = admin_fs.client()  # ✅ usa las credenciales del admin app
+firestore_db = traced_client(admin_fs.client())  # ✅ usa las credenciales del admin app (medido si hay trace)
@@ -0,0 +1,217 @@
+"""
+Gestor en segundo plano de las claves públicas de Google para verificar tokens.
+
+firebase_admin descarga los certificados de forma síncrona dentro de
+verify_id_token/verify_session_cookie cuando vence su caché, y bajo carga varios
+requests pueden pagar esa descarga a la vez. Aquí se descargan al arrancar y se
+refrescan antes del `max-age` en un thread; la verificación usa el set en memoria
+con las mismas validaciones que firebase_admin (alg, kid, aud, iss, sub, exp/iat).
+"""
+import base64
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+import httpx
+from firebase_admin import auth as fb_auth
+from google.auth import jwt as google_jwt
+
+from app.config import FIREBASE_PROJECT_ID, KEY_MANAGER_ENABLED, KEY_REFRESH_MARGIN_SECONDS
+
+logger = logging.getLogger(__name__)
+
+ID_TOKEN_CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+SESSION_COOKIE_CERTS_URL = "https://www.googleapis.com/identitytoolkit/v3/relyingparty/publicKeys"
+
+ID_TOKEN_ISSUER = "https://securetoken.google.com/"
+SESSION_COOKIE_ISSUER = "https://session.firebase.google.com/"
+
+# Si no hay Cache-Control o falla la descarga
+DEFAULT_MAX_AGE_SECONDS = 3600
+RETRY_SECONDS = 30
+# Un kid desconocido dispara un refresh en background como mucho cada tanto
+FORCED_REFRESH_MIN_INTERVAL = 60
+
+class KeySet:
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = url
+        self.certs: Dict[str, str] = {}
+        self.expires_at = 0.0
+        self.fetched_at = 0.0
+
+    def loaded(self) -> bool:
+        return bool(self.certs)
+
+    def refresh(self, client: httpx.Client) -> float:
+        """
+        Descarga los certificados. Devuelve el max-age informado por Google.
+        """
+        r = client.get(self.url)
+        r.raise_for_status()
+        certs = r.json()
+        if not isinstance(certs, dict) or not certs:
+            raise ValueError(f"respuesta de claves inválida ({self.name})")
+        m = re.search(r"max-age=(\d+)", r.headers.get("cache-control", ""))
+        max_age = float(m.group(1)) if m else DEFAULT_MAX_AGE_SECONDS
+        # Reemplazo atómico: los lectores ven el set viejo o el nuevo completo
+        self.certs = certs
+        self.fetched_at = time.time()
+        self.expires_at = self.fetched_at + max_age
+        return max_age
+
+class KeyManager:
+    def __init__(self):
+        self.id_token_keys = KeySet("id_token", ID_TOKEN_CERTS_URL)
+        self.session_keys = KeySet("session_cookie", SESSION_COOKIE_CERTS_URL)
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_forced = 0.0
+        self.stats = {"refreshes": 0, "failures": 0, "fallbacks": 0}
+
+    # ====== CICLO DE VIDA ======
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        # Primera carga al arrancar (si falla, se verifica con firebase_admin hasta que cargue)
+        self._refresh_all()
+        self._thread = threading.Thread(target=self._run, name="key-manager", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def _refresh_all(self) -> float:
+        """
+        Refresca ambos sets; devuelve cuántos segundos esperar al próximo refresh.
+        """
+        wait = None
+        with httpx.Client(timeout=10) as client:
+            for ks in (self.id_token_keys, self.session_keys):
+                try:
+                    max_age = ks.refresh(client)
+                    self.stats["refreshes"] += 1
+                    next_in = max(max_age - KEY_REFRESH_MARGIN_SECONDS, max_age / 2)
+                except Exception as e:
+                    self.stats["failures"] += 1
+                    logger.warning("refresh de claves %s falló: %s", ks.name, e)
+                    next_in = RETRY_SECONDS
+                wait = next_in if wait is None else min(wait, next_in)
+        return wait or RETRY_SECONDS
+
+    def _run(self) -> None:
+        wait = self._next_wait()
+        while not self._stop.is_set():
+            self._wake.wait(wait)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            wait = self._refresh_all()
+
+    def _next_wait(self) -> float:
+        now = time.time()
+        waits = [
+            (ks.expires_at - KEY_REFRESH_MARGIN_SECONDS - now) if ks.loaded() else RETRY_SECONDS
+            for ks in (self.id_token_keys, self.session_keys)
+        ]
+        return max(1.0, min(waits))
+
+    def _request_refresh(self) -> None:
+        now = time.time()
+        if now - self._last_forced >= FORCED_REFRESH_MIN_INTERVAL:
+            self._last_forced = now
+            self._wake.set()
+
+    # ====== VERIFICACIÓN ======
+    def _verify(self, token: str, keys: KeySet, issuer_prefix: str, invalid_error, expired_error,
+                clock_skew_seconds: int):
+        header, payload = _decode_unverified(token, invalid_error)
+        kid = header.get("kid")
+
+        error = None
+        if header.get("alg") != "RS256":
+            error = f'algoritmo incorrecto: se esperaba "RS256" y llegó "{header.get("alg")}"'
+        elif not kid:
+            error = 'el token no tiene "kid"'
+        elif payload.get("aud") != FIREBASE_PROJECT_ID:
+            error = f'"aud" incorrecto: se esperaba "{FIREBASE_PROJECT_ID}"'
+        elif payload.get("iss") != issuer_prefix + FIREBASE_PROJECT_ID:
+            error = f'"iss" incorrecto: se esperaba "{issuer_prefix + FIREBASE_PROJECT_ID}"'
+        elif not isinstance(payload.get("sub"), str) or not payload.get("sub") or len(payload["sub"]) > 128:
+            error = '"sub" (subject) ausente o inválido'
+        if error:
+            raise invalid_error(error)
+
+        if kid not in keys.certs:
+            # Rotación de claves: refresco en background, este request no espera la descarga
+            self._request_refresh()
+            raise invalid_error(f'"kid" desconocido: {kid}')
+
+        try:
+            claims = google_jwt.decode(
+                token,
+                certs=keys.certs,
+                audience=FIREBASE_PROJECT_ID,
+                clock_skew_in_seconds=clock_skew_seconds,
+            )
+        except ValueError as e:
+            if "Token expired" in str(e):
+                raise expired_error(str(e), cause=e)
+            raise invalid_error(str(e), cause=e)
+        claims["uid"] = claims["sub"]
+        return claims
+
+    def verify_id_token(self, token: str, clock_skew_seconds: int = 0):
+        if not self._usable(self.id_token_keys):
+            self.stats["fallbacks"] += 1
+            return fb_auth.verify_id_token(token, clock_skew_seconds=clock_skew_seconds)
+        return self._verify(
+            token, self.id_token_keys, ID_TOKEN_ISSUER,
+            fb_auth.InvalidIdTokenError, fb_auth.ExpiredIdTokenError,
+            clock_skew_seconds,
+        )
+
+    def verify_session_cookie(self, cookie: str, clock_skew_seconds: int = 0):
+        if not self._usable(self.session_keys):
+            self.stats["fallbacks"] += 1
+            return fb_auth.verify_session_cookie(
+                cookie, check_revoked=False, clock_skew_seconds=clock_skew_seconds
+            )
+        return self._verify(
+            cookie, self.session_keys, SESSION_COOKIE_ISSUER,
+            fb_auth.InvalidSessionCookieError, fb_auth.ExpiredSessionCookieError,
+            clock_skew_seconds,
+        )
+
+    def _usable(self, keys: KeySet) -> bool:
+        # Deshabilitado, emulador o claves aún no cargadas -> firebase_admin
+        return KEY_MANAGER_ENABLED and keys.loaded() and not os.getenv("FIREBASE_AUTH_EMULATOR_HOST")
+
+    def snapshot(self) -> Dict:
+        return {
+            "id_token_keys": len(self.id_token_keys.certs),
+            "session_keys": len(self.session_keys.certs),
+            "id_token_expires_in": round(self.id_token_keys.expires_at - time.time()),
+            "session_expires_in": round(self.session_keys.expires_at - time.time()),
+            **self.stats,
+        }
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+def _decode_unverified(token: str, invalid_error):
+    if not isinstance(token, str) or not token:
+        raise invalid_error("token vacío o inválido")
+    try:
+        header_b64, payload_b64, _ = token.split(".")
+        return json.loads(_b64decode(header_b64)), json.loads(_b64decode(payload_b64))
+    except Exception as e:
+        raise invalid_error(f"token mal formado: {e}", cause=e)
+
+key_manager = KeyManager()
@@ -0,0 +1,310 @@
+"""
+Trazado por request (opt-in) para diagnosticar endpoints lentos.
+
+Si el request trae el header `X-Debug-Trace: 1` se registra un árbol de spans con las
+llamadas a fb_auth, cada get/set/stream/... de Firestore (ruta del doc + latencia) y el
+tiempo total del handler. Solo se devuelve (header `Server-Timing`) si el usuario
+autenticado es platform_admin; opcionalmente se escribe una muestra en un log JSON
+(en un thread aparte, fuera del event loop).
+"""
+import json
+import logging
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional
+
+from app.config import TRACE_LOG_PATH, TRACE_LOG_SAMPLE_RATE
+
+try:
+    from google.cloud.firestore_v1.base_aggregation import BaseAggregationQuery
+    from google.cloud.firestore_v1.base_batch import BaseWriteBatch
+    from google.cloud.firestore_v1.base_collection import BaseCollectionReference
+    from google.cloud.firestore_v1.base_document import BaseDocumentReference
+    from google.cloud.firestore_v1.base_query import BaseQuery
+    _WRAP_TYPES: tuple = (
+        BaseCollectionReference, BaseDocumentReference, BaseQuery, BaseAggregationQuery, BaseWriteBatch,
+    )
+except ImportError:  # pragma: no cover
+    _WRAP_TYPES = ()
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = "X-Debug-Trace"
+MAX_SERVER_TIMING_ENTRIES = 40
+
+# Operaciones de Firestore que se miden (el resto solo se envuelve/propaga)
+_TIMED = {"get", "set", "update", "delete", "create", "stream", "commit", "get_all"}
+
+class Trace:
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.start = time.perf_counter()
+        self.spans: List[Dict] = []
+        self._stack: List[int] = []
+        self.authorized = False
+        self.uid: Optional[str] = None
+        self.handler_ms: Optional[float] = None
+        self.total_ms: Optional[float] = None
+
+    def open(self, name: str, detail: Optional[str]) -> int:
+        idx = len(self.spans)
+        self.spans.append({
+            "name": name,
+            "detail": detail,
+            "parent": self._stack[-1] if self._stack else None,
+            "start_ms": round((time.perf_counter() - self.start) * 1000, 3),
+            "dur_ms": None,
+        })
+        self._stack.append(idx)
+        return idx
+
+    def close(self, idx: int, t0: float) -> None:
+        self.spans[idx]["dur_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+        if self._stack and self._stack[-1] == idx:
+            self._stack.pop()
+        elif idx in self._stack:
+            self._stack.remove(idx)
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.start) * 1000, 3)
+
+    def server_timing(self) -> str:
+        entries = []
+        totals: Dict[str, float] = {}
+        for i, s in enumerate(self.spans):
+            kind = s["name"].split(".")[0]
+            totals[kind] = totals.get(kind, 0.0) + (s["dur_ms"] or 0.0)
+            if i < MAX_SERVER_TIMING_ENTRIES:
+                desc = s["name"] + (f" {s['detail']}" if s["detail"] else "")
+                desc = desc.replace('"', "'")
+                entries.append(f'{_token(kind)}-{i};desc="{desc}";dur={s["dur_ms"] or 0}')
+        entries += [f"{_token(k)}-total;dur={round(v, 3)}" for k, v in totals.items()]
+        entries.append(f"handler;dur={self.handler_ms if self.handler_ms is not None else self.elapsed_ms()}")
+        return ", ".join(entries)
+
+    def to_dict(self) -> Dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "uid": self.uid,
+            "handler_ms": self.handler_ms,
+            "total_ms": self.total_ms,
+            "spans": self.spans,
+        }
+
+def _token(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_-]", "-", name) or "span"
+
+_current: ContextVar[Optional[Trace]] = ContextVar("request_trace", default=None)
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+@contextmanager
+def span(name: str, detail: Optional[str] = None):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    idx = trace.open(name, detail)
+    try:
+        yield
+    finally:
+        trace.close(idx, t0)
+
+# ====== FIRESTORE ======
+def _describe(target) -> str:
+    path = getattr(target, "path", None)  # DocumentReference
+    if isinstance(path, str):
+        return path
+    target = getattr(target, "_nested_query", target)  # AggregationQuery
+    parent = getattr(target, "_parent", None)  # Query
+    coll_path = getattr(parent if parent is not None else target, "_path", None)
+    if coll_path:
+        return "/".join(coll_path)
+    return type(target).__name__
+
+def _unwrap(value):
+    if isinstance(value, _Traced):
+        return value._target
+    if isinstance(value, (list, tuple)):
+        return type(value)(_unwrap(v) for v in value)
+    return value
+
+def _wrap(value):
+    if _WRAP_TYPES and isinstance(value, _WRAP_TYPES):
+        return _Traced(value)
+    return value
+
+def _traced_stream(gen, trace: Trace, detail: str):
+    # El stream es lazy: se mide hasta agotar el iterador
+    t0 = time.perf_counter()
+    idx = trace.open("firestore.stream", detail)
+    count = 0
+    try:
+        for item in gen:
+            count += 1
+            yield item
+    finally:
+        trace.close(idx, t0)
+        trace.spans[idx]["detail"] = f"{detail} ({count} docs)"
+
+class _Traced:
+    """
+    Proxy transparente sobre cliente/refs/queries de Firestore que mide las operaciones
+    cuando hay un trace activo. Sin trace el costo es un ContextVar.get por llamada.
+    """
+    __slots__ = ("_target",)
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            args = tuple(_unwrap(a) for a in args)
+            kwargs = {k: _unwrap(v) for k, v in kwargs.items()}
+            trace = _current.get()
+            if trace is None or name not in _TIMED:
+                return _wrap(attr(*args, **kwargs))
+            detail = _describe(self._target)
+            if name in ("stream", "get_all"):
+                return _traced_stream(attr(*args, **kwargs), trace, detail)
+            t0 = time.perf_counter()
+            idx = trace.open(f"firestore.{name}", detail)
+            try:
+                return _wrap(attr(*args, **kwargs))
+            finally:
+                trace.close(idx, t0)
+
+        return call
+
+    def __iter__(self):
+        return iter(self._target)
+
+    def __repr__(self):
+        return f"Traced({self._target!r})"
+
+def traced_client(client):
+    return _Traced(client)
+
+# ====== LOG JSON MUESTREADO ======
+# El request solo encola; un QueueListener escribe el archivo en su propio thread
+TRACE_LOG_MAX_PENDING = 1000
+
+class _TraceLine:
+    # Se serializa al formatear, ya en el thread del listener
+    __slots__ = ("data",)
+
+    def __init__(self, data: Dict):
+        self.data = data
+
+    def __str__(self) -> str:
+        return json.dumps(self.data, default=str)
+
+class _TraceQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Sin formatear en el event loop (el trace ya no cambia)
+        return record
+
+    def enqueue(self, record) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Es una muestra de diagnóstico: con el disco lento se descarta
+            pass
+
+_trace_logger = logging.getLogger("app.trace")
+_trace_logger.propagate = False
+_trace_logger.setLevel(logging.INFO)
+_listener: Optional[QueueListener] = None
+_listener_lock = threading.Lock()
+
+def _ensure_listener() -> None:
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+        q: "queue.Queue" = queue.Queue(maxsize=TRACE_LOG_MAX_PENDING)
+        # delay=True: el archivo se abre en la primera escritura (thread del listener)
+        file_handler = logging.FileHandler(TRACE_LOG_PATH, encoding="utf-8", delay=True)
+        file_handler.setFormatter(logging.Formatter("%(message)s"))
+        _trace_logger.addHandler(_TraceQueueHandler(q))
+        _listener = QueueListener(q, file_handler)
+        _listener.start()
+
+def stop_trace_log() -> None:
+    """
+    Escribe lo pendiente y detiene el listener (llamar en el shutdown).
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            return
+        try:
+            _listener.stop()
+        except queue.Full:
+            logger.warning("cola de traces llena al cerrar; se descartan los pendientes")
+        for h in list(_trace_logger.handlers):
+            _trace_logger.removeHandler(h)
+        for h in _listener.handlers:
+            h.close()
+        _listener = None
+
+def _maybe_log(trace: Trace) -> None:
+    if not TRACE_LOG_PATH or random.random() >= TRACE_LOG_SAMPLE_RATE:
+        return
+    _ensure_listener()
+    _trace_logger.info(_TraceLine(trace.to_dict()))
+
+# ====== MIDDLEWARE ======
+class TracingMiddleware:
+    """
+    Middleware ASGI: activa el trace si llega el header y agrega `Server-Timing`
+    al iniciar la respuesta (solo si get_current_user lo autorizó).
+    """
+    def __init__(self, app):
+        self.app = app
+        self._header = TRACE_HEADER.lower().encode()
+
+    def _requested(self, scope) -> bool:
+        for k, v in scope.get("headers") or []:
+            if k == self._header:
+                return v.strip().lower() in (b"1", b"true", b"on")
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(scope.get("method", ""), scope.get("path", ""))
+        token = _current.set(trace)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                trace.handler_ms = trace.elapsed_ms()
+                if trace.authorized:
+                    headers = list(message.get("headers") or [])
+                    headers.append((b"server-timing", trace.server_timing().encode("latin-1", "replace")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            trace.total_ms = trace.elapsed_ms()
+            if trace.authorized:
+                _maybe_log(trace)
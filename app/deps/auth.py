@@ -1,10 +1,20 @@
 # deps/auth.py
 from fastapi import Header, HTTPException, status, Request
-from firebase_admin import auth as fb_auth
+from fastapi.concurrency import run_in_threadpool
 from typing import Optional
+from google.cloud import firestore
 from app.config import ENABLE_FIRESTORE_PROVISIONING, SESSION_COOKIE_NAME
 from app.core.firebase import firestore_db
+from app.core.cache import token_cache, profile_cache
+from app.core.tracing import current_trace, span
+from app.core.keys import key_manager
+from app.services import principals_service
+from app.services.users_service import get_profile, with_search_fields
+from app.services.roles_service import is_platform_admin
+from app.services.session_service import should_renew, renew_session, RENEWAL_STATE_KEY
+import hashlib
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -24,18 +34,16 @@ def _verify_session_with_skew(cookie: str):
     reintenta con tolerancia de reloj (SKEW_SECONDS).
     """
     try:
-        return fb_auth.verify_session_cookie(cookie, check_revoked=False)
+        with span("fb_auth.verify_session_cookie"):
+            return key_manager.verify_session_cookie(cookie)
     except Exception as e:
         if "Token used too early" in str(e):
             logger.warning(
                 "verify_session_cookie: 'used too early', reintentando con %ss...",
                 SKEW_SECONDS,
             )
-            return fb_auth.verify_session_cookie(
-                cookie,
-                check_revoked=False,
-                clock_skew_seconds=SKEW_SECONDS,
-            )
+            with span("fb_auth.verify_session_cookie", "skew"):
+                return key_manager.verify_session_cookie(cookie, clock_skew_seconds=SKEW_SECONDS)
         raise
 
 def _verify_id_token_with_skew(token: str):
@@ -44,34 +52,52 @@ def _verify_id_token_with_skew(token: str):
     reintenta con tolerancia de reloj (SKEW_SECONDS).
     """
     try:
-        return fb_auth.verify_id_token(token)
+        with span("fb_auth.verify_id_token"):
+            return key_manager.verify_id_token(token)
     except Exception as e:
         if "Token used too early" in str(e):
             logger.warning(
                 "verify_id_token: 'used too early', reintentando con %ss...",
                 SKEW_SECONDS,
             )
-            return fb_auth.verify_id_token(token, clock_skew_seconds=SKEW_SECONDS)
+            with span("fb_auth.verify_id_token", "skew"):
+                return key_manager.verify_id_token(token, clock_skew_seconds=SKEW_SECONDS)
         raise
 
+def _cached_verify(kind: str, token: str, verify):
+    """
+    Devuelve los claims verificados desde la caché (L1/L2) o verifica y los guarda
+    hasta el `exp` del token.
+    """
+    key = hashlib.sha256(f"{kind}:{token}".encode()).hexdigest()
+    decoded = token_cache.get(key)
+    if decoded is not None:
+        return decoded
+    decoded = verify(token)
+    ttl = int(decoded.get("exp", 0)) - int(time.time())
+    if ttl > 0:
+        token_cache.set(key, decoded, ttl)
+    return decoded
+
 async def get_current_user(request: Request, authorization: Optional[str] = Header(None)):
     # 1) Intentar cookie de sesión
     session_cookie = request.cookies.get(SESSION_COOKIE_NAME)
     decoded = None
     if session_cookie:
         try:
-            decoded = _verify_session_with_skew(session_cookie)
+            decoded = _cached_verify("session", session_cookie, _verify_session_with_skew)
         except Exception as e:
             logger.exception("verify_session_cookie failed")
             decoded = None
 
     # 2) Intentar Bearer si no hubo cookie válida
+    from_cookie = decoded is not None
     if not decoded:
         token = _extract_bearer(authorization)
         if not token:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token requerido.")
         try:
-            decoded = _verify_id_token_with_skew(token)
+            decoded = _cached_verify("id", token, _verify_id_token_with_skew)
         except Exception as e:
             logger.exception("verify_id_token failed")
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Token inválido: {e}")
@@ -80,12 +106,28 @@ async def get_current_user(request: Request, authorization: Optional[str] = Head
     if not uid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="UID faltante.")
 
+    # Renovación deslizante: cookie válida cerca de expirar -> SessionRenewalMiddleware
+    # la agrega a la respuesta que devuelva el handler
+    if from_cookie and should_renew(decoded):
+        renewed = await run_in_threadpool(renew_session, uid, decoded)
+        if renewed:
+            setattr(request.state, RENEWAL_STATE_KEY, (uid, renewed))
+
+    # Trace pedido por header: solo se expone a platform_admin
+    trace = current_trace()
+    if trace is not None:
+        trace.uid = uid
+        try:
+            trace.authorized = is_platform_admin(uid)
+        except Exception:
+            trace.authorized = False
+
     profile = None
     if ENABLE_FIRESTORE_PROVISIONING:
         try:
-            doc_ref = firestore_db.collection("users").document(uid)
-            doc = doc_ref.get()
-            if not doc.exists:
+            profile = get_profile(uid)
+            if profile is None:
+                doc_ref = firestore_db.collection("users").document(uid)
                 profile = {
                     "uid": uid,
                     "email": decoded.get("email"),
@@ -93,9 +135,17 @@ async def get_current_user(request: Request, authorization: Optional[str] = Head
                     "photoURL": decoded.get("picture"),
                     "providers": (decoded.get("firebase") or {}).get("sign_in_provider"),
                 }
-                doc_ref.set(profile, merge=True)
-            else:
-                profile = doc.to_dict()
+                # updatedAt: sin él el perfil no aparece en /users/changes ni mueve el ETag de /users
+                doc_ref.set(
+                    {
+                        **with_search_fields(profile),
+                        "createdAt": firestore.SERVER_TIMESTAMP,
+                        "updatedAt": firestore.SERVER_TIMESTAMP,
+                    },
+                    merge=True,
+                )
+                profile_cache.invalidate(uid)
+                principals_service.sync_profile(uid, profile)
         except Exception:
             profile = None
 
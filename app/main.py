@@ -1,11 +1,57 @@
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.config import ALLOWED_ORIGINS
+from fastapi.middleware.gzip import GZipMiddleware
+from app.config import ALLOWED_ORIGINS, COMPRESSION_MIN_SIZE
+from app.core.tracing import TracingMiddleware, TRACE_HEADER, stop_trace_log
+from app.core.admission import AdmissionMiddleware, admission_stats
+from app.core.keys import key_manager
 from app.routers import auth as auth_router
 from app.routers import users as users_router
 from app.routers import careers as careers_router
+from app.services.deletion_service import run_deletion_sweeper
+from app.services.audit_service import audit_writer
+from app.services.session_service import SessionRenewalMiddleware
+
+try:
+    from brotli_asgi import BrotliMiddleware  # opcional: br con fallback a gzip
+except ImportError:  # pragma: no cover
+    BrotliMiddleware = None
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Jobs de borrado pendientes, fallidos o abandonados (lease vencido); el claim evita duplicados entre workers
+    stop_sweeper = threading.Event()
+    threading.Thread(target=run_deletion_sweeper, args=(stop_sweeper,), name="deletion-sweeper", daemon=True).start()
+    audit_writer.start()
+    # Claves de Google cargadas antes de atender requests y refrescadas en background
+    await asyncio.to_thread(key_manager.start)
+    yield
+    stop_sweeper.set()
+    key_manager.stop()
+    # Drenar el audit log y el log de traces antes de salir
+    audit_writer.stop()
+    stop_trace_log()
+
+app = FastAPI(title="Auth + FastAPI + Firebase", version="1.0.0", lifespan=lifespan)
 
-app = FastAPI(title="Auth + FastAPI + Firebase", version="1.0.0")
+# Compresión de respuestas grandes (p.ej. GET /users para admins)
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MIN_SIZE, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+
+# Set-Cookie de sesiones renovadas sobre la respuesta real (incluye 304 y streaming)
+app.add_middleware(SessionRenewalMiddleware)
+
+# Bulkheads por grupo de rutas (dentro de CORS para que los 429/503 lleven sus headers)
+app.add_middleware(AdmissionMiddleware)
 
 # CORS (ajusta según tu frontend)
 app.add_middleware(
@@ -13,9 +59,13 @@ app.add_middleware(
     allow_origins=['http://localhost:3000', 'https://ucb-e-commerce.vercel.app'],
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization"],
+    allow_headers=["Content-Type", "Authorization", TRACE_HEADER],
+    expose_headers=["Server-Timing", "Retry-After", "ETag"],
 )
 
+# Trazado opt-in por request (header X-Debug-Trace -> Server-Timing)
+app.add_middleware(TracingMiddleware)
+
 app.include_router(auth_router.router)
 app.include_router(users_router.router)
 app.include_router(careers_router.router)
@@ -23,3 +73,10 @@ app.include_router(careers_router.router)
 @app.get("/health")
 def health():
     return {"ok": True}
+
+@app.get("/health/admission")
+def health_admission():
+    """
+    Métricas de saturación de los bulkheads (en vuelo, en cola, rechazos).
+    """
+    return {"ok": True, "groups": admission_stats()}
@@ -1,5 +1,4 @@
 from fastapi import APIRouter, Response, HTTPException, status, Request
-from datetime import datetime, timezone
 import httpx
 
 from firebase_admin import auth as fb_auth
@@ -9,8 +8,11 @@ from app.config import (
 )
 from app.schemas.auth import EmailRegister, EmailLogin, RefreshRequest, GoogleIdpLogin
 from app.schemas.user import LoginWithIdToken
-from app.services.users_service import best_effort_materialize
+from app.services.users_service import materialize_on_login
 from app.services.roles_service import ensure_default_student
+from app.services.session_service import set_session_cookie
+from app.core.tracing import span
+from app.core.keys import key_manager
 import logging
 
 logger = logging.getLogger(__name__)
@@ -26,7 +28,8 @@ def _verify_id_token_with_skew(id_token: str, skew_seconds: int = 15):
     reintenta con una tolerancia de reloj (clock skew).
     """
     try:
-        return fb_auth.verify_id_token(id_token)
+        with span("fb_auth.verify_id_token"):
+            return key_manager.verify_id_token(id_token)
     except Exception as e:
         msg = str(e)
         if "Token used too early" in msg:
@@ -35,7 +38,8 @@ def _verify_id_token_with_skew(id_token: str, skew_seconds: int = 15):
                 skew_seconds,
             )
             # IMPORTANTE: usar argumento keyword para evitar confundir el orden de params
-            return fb_auth.verify_id_token(id_token, clock_skew_seconds=skew_seconds)
+            with span("fb_auth.verify_id_token", "skew"):
+                return key_manager.verify_id_token(id_token, clock_skew_seconds=skew_seconds)
         # Cualquier otro error se propaga igual
         raise
 
@@ -88,21 +92,13 @@ async def google_login_or_register(body: GoogleIdpLogin, response: Response):
 
     # 2) Crear cookie de sesión
     try:
-        session_cookie = fb_auth.create_session_cookie(id_token, expires_in=SESSION_EXPIRES_DELTA)
+        with span("fb_auth.create_session_cookie"):
+            session_cookie = fb_auth.create_session_cookie(id_token, expires_in=SESSION_EXPIRES_DELTA)
     except Exception as e:
         logger.exception("create_session_cookie failed")
         raise HTTPException(400, detail=f"No se pudo crear la sesión: {e}")
 
-    expires_at = datetime.now(timezone.utc) + SESSION_EXPIRES_DELTA
-    response.set_cookie(
-        key=SESSION_COOKIE_NAME,
-        value=session_cookie,
-        httponly=True,
-        secure=SESSION_COOKIE_SECURE,
-        samesite="lax",
-        path="/",
-        expires=int(expires_at.timestamp()),
-    )
+    expires_at = set_session_cookie(response, session_cookie)
 
     # 3) Materializar perfil sin romper el flujo si falla
     uid = decoded.get("uid")
@@ -114,11 +110,12 @@ async def google_login_or_register(body: GoogleIdpLogin, response: Response):
         "providers": "google.com",
     }
     try:
-        best_effort_materialize(uid, base_profile)
+        # Usuarios ya provisionados (login repetido o import) no escriben nada
+        materialize_on_login(uid, base_profile)
         # ✅ Rol por defecto en colección `roles`
         ensure_default_student(uid)
     except Exception as e:
-        logger.warning("best_effort_materialize/ensure_default_student falló (continuo): %s", e)
+        logger.warning("materialize_on_login/ensure_default_student falló (continuo): %s", e)
 
     return {"ok": True, "uid": uid, "expiresAt": expires_at.isoformat()}
 
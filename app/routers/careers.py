@@ -1,9 +1,11 @@
 from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from app.deps.auth import get_current_user
 from app.services.careers_service import list_careers, ensure_career
 from app.services.roles_service import is_platform_admin, get_roles
+from app.services.import_service import import_careers
 
 router = APIRouter(prefix="/careers", tags=["careers"])
 
@@ -36,10 +38,25 @@ def careers_create(body: CareerBody, current=Depends(get_current_user)):
     (Si quieres permitir a admins crear, cambia el chequeo)
     """
     uid = current["uid"]
-    if not is_platform_admin(uid):
+    if not is_platform_admin(uid, fresh=True):
         raise HTTPException(status_code=403, detail="Solo platform_admin puede crear carreras.")
     try:
         saved = ensure_career(body.code, body.name)
         return {"ok": True, "career": saved}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/import", status_code=status.HTTP_200_OK)
+async def careers_import(request: Request, current=Depends(get_current_user)):
+    """
+    Importa carreras desde un CSV (body `text/csv`, columnas code,name). Requiere platform_admin.
+    Idempotente: re-importar el mismo CSV solo actualiza `name`/`updatedAt`.
+    """
+    if not await run_in_threadpool(is_platform_admin, current["uid"], fresh=True):
+        raise HTTPException(status_code=403, detail="Solo platform_admin puede importar carreras.")
+    text = (await request.body()).decode("utf-8", errors="replace")
+    try:
+        stats = await run_in_threadpool(import_careers, text)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ok": True, **stats}
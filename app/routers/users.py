@@ -1,13 +1,26 @@
-from typing import List, Dict
+import csv
+import hashlib
+import io
+import json
+from datetime import datetime
+from typing import List, Dict, Iterator, Optional
 from app.schemas.roles import MakeAdminBody, RemoveAdminBody, MakePlatformAdminBody, RemovePlatformAdminBody
-from fastapi import APIRouter, Depends, HTTPException, status
-from firebase_admin import auth as fb_auth
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 
 from app.deps.auth import get_current_user
 from app.schemas.user import MeResponse, UpdateProfile
-from app.services.users_service import upsert_profile, get_profile, delete_profile
+from app.services.users_service import upsert_profile, get_profile, iter_user_pages, search_users, cached_collection_fingerprint
+from app.services.roles_service import ROLES_COLL
+from app.services.principals_service import PRINCIPALS_COLL
+from app.services.deletion_service import enqueue_deletion, process_deletion
+from app.services.sync_service import changes_since, TOMBSTONES_COLL
+from app.services.import_service import import_users
 from app.services.roles_service import get_roles, add_admin_for_career, can_manage_career, is_platform_admin, remove_admin_for_career, make_platform_admin, remove_platform_admin
+from app.services.principals_service import get_principal, stream_principals, iter_principal_pages
 from app.core.firebase import firestore_db
+from app.config import USE_PRINCIPALS_VIEW, EXPORT_CHUNK_SIZE
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -18,17 +31,94 @@ def _primary_role(roles: List[str]) -> str:
         return "admin"
     return "student"
 
+def _user_row(uid: str, prof: Dict, rdoc: Dict) -> Dict:
+    roles = rdoc.get("roles") or ["student"]
+    return {
+        "uid": uid,
+        "email": prof.get("email"),
+        "displayName": prof.get("displayName"),
+        "photoURL": prof.get("photoURL"),
+        "profile": prof,
+        "roles": roles,
+        "role": "admin" if "admin" in roles else "student",
+        "admin_careers": rdoc.get("admin_careers") or [],
+        "platform_admin": bool(rdoc.get("platform_admin")),
+    }
+
+def _require_admin(uid: str) -> Dict:
+    # Requiere ser admin (de alguna carrera) o platform_admin; devuelve su doc de roles
+    roles_doc = get_roles(uid)
+    if not ("admin" in (roles_doc.get("roles") or []) or roles_doc.get("platform_admin")):
+        raise HTTPException(status_code=403, detail="No autorizado")
+    return roles_doc
+
+def _is_visible(u: Dict, roles_doc: Dict) -> bool:
+    # (Opcional) Filtros por carrera que administra el solicitante (si no es platform_admin)
+    if roles_doc.get("platform_admin"):
+        return True
+    # Un admin puede ver:
+    #  - a otros admins que compartan al menos una carrera
+    #  - a todos los students (si lo prefieres, puedes restringir más)
+    if "admin" in u["roles"]:
+        allowed = set(roles_doc.get("admin_careers") or [])
+        return bool(allowed.intersection(set(u.get("admin_careers") or [])))
+    return True
+
+def _filter_visible(results: List[Dict], roles_doc: Dict) -> List[Dict]:
+    if roles_doc.get("platform_admin"):
+        return results
+    return [u for u in results if _is_visible(u, roles_doc)]
+
+def _visible_deleted(deleted: List[Dict], roles_doc: Dict) -> List[Dict]:
+    # Mismo criterio que las filas, con los roles guardados en el tombstone;
+    # un tombstone sin roles (anterior a guardarlos) solo lo ve platform_admin
+    return [
+        {"uid": d["uid"], "deletedAt": d.get("deletedAt")}
+        for d in deleted
+        if roles_doc.get("platform_admin") or (d.get("roles") is not None and _is_visible(d, roles_doc))
+    ]
+
+def _json_default(o):
+    if isinstance(o, datetime):
+        return o.isoformat()
+    return str(o)
+
+def _list_etag(roles_doc: Dict) -> str:
+    """
+    ETag débil de `GET /users` (el mismo para cualquier Content-Encoding): cantidad +
+    updatedAt máximo de las colecciones leídas, cantidad + último borrado de los
+    tombstones y la visibilidad del solicitante (platform_admin / carreras que administra).
+    """
+    colls = [PRINCIPALS_COLL] if USE_PRINCIPALS_VIEW else ["users", ROLES_COLL]
+    parts = [f"{c}:{cached_collection_fingerprint(c)}" for c in colls]
+    # Los borrados dejan tombstone: un alta + una baja no dejan el tag igual
+    parts.append(f"{TOMBSTONES_COLL}:{cached_collection_fingerprint(TOMBSTONES_COLL, 'deletedAt')}")
+    parts.append(f"pa:{bool(roles_doc.get('platform_admin'))}")
+    parts.append("careers:" + ",".join(sorted(roles_doc.get("admin_careers") or [])))
+    return 'W/"' + hashlib.sha256("|".join(parts).encode()).hexdigest()[:32] + '"'
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # Comparación débil (If-None-Match): se ignora el prefijo W/ de ambos lados
+    opaque = etag.removeprefix("W/")
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return "*" in tags or opaque in tags
+
+EXPORT_CSV_FIELDS = ["uid", "email", "displayName", "photoURL", "role", "roles", "admin_careers", "platform_admin"]
+
 # ====== ENDPOINTS ======
 
 @router.get("/me", response_model=MeResponse)
 def me(current=Depends(get_current_user)):
     uid = current["uid"]
 
+    # Vista `principals`: perfil + roles en un solo doc
+    principal = get_principal(uid) if USE_PRINCIPALS_VIEW else None
+
     # Perfil legado (puede traer 'career' simple)
-    prof = current.get("profile") or get_profile(uid) or {}
+    prof = current.get("profile") or (principal or {}).get("profile") or get_profile(uid) or {}
 
     # Doc de roles en colección 'roles'
-    roles_doc = get_roles(uid) or {}
+    roles_doc = principal or get_roles(uid) or {}
     roles = roles_doc.get("roles") or ["student"]
     admin_careers = roles_doc.get("admin_careers") or []
     platform_admin = bool(roles_doc.get("platform_admin"))
@@ -76,20 +166,19 @@ def update_my_profile(body: UpdateProfile, current=Depends(get_current_user)):
     profile = upsert_profile(current["uid"], data)
     return {"ok": True, "profile": profile}
 
-@router.delete("/me")
-def delete_my_account(current=Depends(get_current_user)):
+@router.delete("/me", status_code=status.HTTP_202_ACCEPTED)
+def delete_my_account(background_tasks: BackgroundTasks, current=Depends(get_current_user)):
+    """
+    Encola el borrado de la cuenta (Auth + users/roles/principals) y responde de inmediato.
+    El job es durable en `deletion_jobs/{uid}` y se reintenta en background.
+    """
     uid = current["uid"]
     try:
-        fb_auth.delete_user(uid)
+        enqueue_deletion(uid)
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"No se pudo borrar el usuario en Auth: {e}")
-    try:
-        delete_profile(uid)
-        # Opcional: también podrías borrar su doc en `roles`
-        # firestore_db.collection("roles").document(uid).delete()
-    except Exception:
-        pass
-    return {"ok": True}
+        raise HTTPException(status_code=503, detail=f"No se pudo encolar el borrado: {e}")
+    background_tasks.add_task(process_deletion, uid)
+    return {"ok": True, "status": "pending"}
 
 # ========= NUEVOS ENDPOINTS DE ROLES =========
 
@@ -102,21 +191,38 @@ def make_admin(body: MakeAdminBody, current=Depends(get_current_user)):
       - admin puede asignar SOLO carreras que él mismo administra.
     """
     requester_uid = current["uid"]
-    if not (is_platform_admin(requester_uid) or can_manage_career(requester_uid, body.career)):
+    if not can_manage_career(requester_uid, body.career, fresh=True):
         raise HTTPException(status_code=403, detail="No tienes permisos para asignar admin en esta carrera.")
 
-    updated = add_admin_for_career(body.uid, body.career)
+    try:
+        updated = add_admin_for_career(body.uid, body.career, actor=requester_uid)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {"ok": True, "roles": updated.get("roles"), "admin_careers": updated.get("admin_careers")}
 
 @router.get("", status_code=status.HTTP_200_OK)
-def list_users(current=Depends(get_current_user)):
+def list_users(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    current=Depends(get_current_user),
+):
     """
     Lista usuarios con perfil y roles. Requiere ser admin (de alguna carrera) o platform_admin.
+    Soporta GET condicional: con `If-None-Match` igual al ETag actual responde 304 sin body.
     """
-    requester_uid = current["uid"]
-    roles_doc = get_roles(requester_uid)
-    if not ("admin" in (roles_doc.get("roles") or []) or roles_doc.get("platform_admin")):
-        raise HTTPException(status_code=403, detail="No autorizado")
+    roles_doc = _require_admin(current["uid"])
+
+    etag = _list_etag(roles_doc)
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+
+    if USE_PRINCIPALS_VIEW:
+        # Un solo scan de la vista desnormalizada
+        results: List[Dict] = [_user_row(p["uid"], p.get("profile") or {}, p) for p in stream_principals()]
+        results = _filter_visible(results, roles_doc)
+        return {"ok": True, "count": len(results), "users": results}
 
     # Traer perfiles
     users_ref = firestore_db.collection("users")
@@ -133,45 +239,132 @@ def list_users(current=Depends(get_current_user)):
     roles_map: Dict[str, Dict] = {doc.id: (doc.to_dict() or {}) for doc in roles_iter}
 
     # Combinar
-    results: List[Dict] = []
-    for uid, prof in users.items():
-        rdoc = roles_map.get(uid, {"roles": ["student"], "admin_careers": []})
-        roles = rdoc.get("roles") or ["student"]
-        results.append({
-            "uid": uid,
-            "email": prof.get("email"),
-            "displayName": prof.get("displayName"),
-            "photoURL": prof.get("photoURL"),
-            "profile": prof,
-            "roles": roles,
-            "role": "admin" if "admin" in roles else "student",
-            "admin_careers": rdoc.get("admin_careers") or [],
-            "platform_admin": bool(rdoc.get("platform_admin")),
-        })
+    results: List[Dict] = [
+        _user_row(uid, prof, roles_map.get(uid, {"roles": ["student"], "admin_careers": []}))
+        for uid, prof in users.items()
+    ]
+    results = _filter_visible(results, roles_doc)
 
-    # (Opcional) Filtros por carrera que administra el solicitante (si no es platform_admin)
-    if not roles_doc.get("platform_admin"):
-        allowed = set(roles_doc.get("admin_careers") or [])
-        # Un admin puede ver:
-        #  - a otros admins que compartan al menos una carrera
-        #  - a todos los students (si lo prefieres, puedes restringir más)
-        filtered = []
-        for u in results:
-            if "admin" in u["roles"]:
-                if allowed.intersection(set(u.get("admin_careers") or [])):
-                    filtered.append(u)
-            else:
-                filtered.append(u)
-        results = filtered
+    return {"ok": True, "count": len(results), "users": results}
 
+@router.get("/search", status_code=status.HTTP_200_OK)
+def search_users_endpoint(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    current=Depends(get_current_user),
+):
+    """
+    Busca usuarios por prefijo de email o displayName. Devuelve los primeros `limit`
+    con roles; mismos permisos y filtros que `GET /users`.
+    """
+    roles_doc = _require_admin(current["uid"])
+    # La visibilidad se aplica durante la búsqueda: los ocultos no consumen el `limit`
+    accept = None
+    if not roles_doc.get("platform_admin"):
+        accept = lambda uid, prof, rdoc: _is_visible(_user_row(uid, prof, rdoc), roles_doc)
+    results = [_user_row(uid, prof, rdoc) for uid, prof, rdoc in search_users(q, limit, accept)]
     return {"ok": True, "count": len(results), "users": results}
 
+@router.get("/changes", status_code=status.HTTP_200_OK)
+def users_changes(
+    since: datetime = Query(..., description="Watermark ISO-8601 devuelto por la llamada anterior"),
+    current=Depends(get_current_user),
+):
+    """
+    Delta sync: usuarios cuyo perfil o roles cambiaron después de `since`, más los
+    borrados (tombstones) que el solicitante podía ver. Devuelve el nuevo `watermark`
+    para la próxima llamada.
+    Al-menos-una-vez: un mismo cambio puede llegar en dos llamadas seguidas.
+    """
+    roles_doc = _require_admin(current["uid"])
+    rows, deleted, watermark = changes_since(since)
+    results = _filter_visible([_user_row(uid, prof, rdoc) for uid, prof, rdoc in rows], roles_doc)
+    return {
+        "ok": True,
+        "since": since.isoformat(),
+        "watermark": watermark.isoformat(),
+        "count": len(results),
+        "users": results,
+        "deleted": _visible_deleted(deleted, roles_doc),
+    }
+
+def _export_pages() -> Iterator[List[Dict]]:
+    if USE_PRINCIPALS_VIEW:
+        for page in iter_principal_pages(EXPORT_CHUNK_SIZE):
+            yield [_user_row(p["uid"], p.get("profile") or {}, p) for p in page]
+    else:
+        for page in iter_user_pages(EXPORT_CHUNK_SIZE):
+            yield [_user_row(uid, prof, rdoc) for uid, prof, rdoc in page]
+
+@router.get("/export", status_code=status.HTTP_200_OK)
+def export_users(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    current=Depends(get_current_user),
+):
+    """
+    Export en streaming de usuarios con roles (NDJSON o CSV), página por página.
+    Mismos permisos y filtros que `GET /users`; memoria constante.
+    """
+    roles_doc = _require_admin(current["uid"])
+
+    def ndjson() -> Iterator[str]:
+        for page in _export_pages():
+            rows = [u for u in page if _is_visible(u, roles_doc)]
+            if rows:
+                yield "".join(json.dumps(u, default=_json_default, ensure_ascii=False) + "\n" for u in rows)
+
+    def csv_rows() -> Iterator[str]:
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=EXPORT_CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        yield buf.getvalue()
+        for page in _export_pages():
+            buf.seek(0)
+            buf.truncate()
+            for u in page:
+                if _is_visible(u, roles_doc):
+                    writer.writerow({
+                        **u,
+                        "roles": "|".join(u["roles"]),
+                        "admin_careers": "|".join(u["admin_careers"]),
+                    })
+            if buf.tell():
+                yield buf.getvalue()
+
+    if format == "csv":
+        return StreamingResponse(
+            csv_rows(),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": 'attachment; filename="users.csv"'},
+        )
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@router.post("/import", status_code=status.HTTP_200_OK)
+async def import_users_csv(
+    request: Request,
+    create_auth: bool = Query(False),
+    current=Depends(get_current_user),
+):
+    """
+    Pre-provisiona perfiles y rol 'student' desde un CSV (body `text/csv`,
+    columnas uid/email,displayName,photoURL). Requiere platform_admin. Idempotente.
+    Los emails sin cuenta de Firebase Auth quedan `unresolved`; con `create_auth=true` se crean.
+    """
+    if not await run_in_threadpool(is_platform_admin, current["uid"], fresh=True):
+        raise HTTPException(status_code=403, detail="Solo platform_admin puede importar usuarios.")
+    text = (await request.body()).decode("utf-8", errors="replace")
+    try:
+        stats = await run_in_threadpool(import_users, text, create_auth=create_auth)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ok": True, **stats}
+
 @router.post("/roles/remove_admin", status_code=status.HTTP_200_OK)
 def remove_admin(body: RemoveAdminBody, current=Depends(get_current_user)):
     requester_uid = current["uid"]
-    if not (is_platform_admin(requester_uid) or can_manage_career(requester_uid, body.career)):
+    if not can_manage_career(requester_uid, body.career, fresh=True):
         raise HTTPException(status_code=403, detail="No tienes permisos para quitar admin en esta carrera.")
-    updated = remove_admin_for_career(body.uid, body.career)
+    updated = remove_admin_for_career(body.uid, body.career, actor=requester_uid)
     return {"ok": True, "roles": updated.get("roles"), "admin_careers": updated.get("admin_careers")}
 
 @router.post("/roles/make_platform_admin", status_code=status.HTTP_200_OK)
@@ -181,10 +374,10 @@ def make_platform_admin_endpoint(body: MakePlatformAdminBody, current=Depends(ge
     Requiere ser Platform Admin.
     """
     requester_uid = current["uid"]
-    if not is_platform_admin(requester_uid):
+    if not is_platform_admin(requester_uid, fresh=True):
         raise HTTPException(status_code=403, detail="Requiere ser Platform Admin.")
     
-    updated = make_platform_admin(body.uid)
+    updated = make_platform_admin(body.uid, actor=requester_uid)
     return {"ok": True, "platform_admin": updated.get("platform_admin")}
 
 @router.post("/roles/remove_platform_admin", status_code=status.HTTP_200_OK)
@@ -194,8 +387,8 @@ def remove_platform_admin_endpoint(body: RemovePlatformAdminBody, current=Depend
     Requiere ser Platform Admin.
     """
     requester_uid = current["uid"]
-    if not is_platform_admin(requester_uid):
+    if not is_platform_admin(requester_uid, fresh=True):
         raise HTTPException(status_code=403, detail="Requiere ser Platform Admin.")
     
-    updated = remove_platform_admin(body.uid)
+    updated = remove_platform_admin(body.uid, actor=requester_uid)
     return {"ok": True, "platform_admin": updated.get("platform_admin")}
@@ -0,0 +1,18 @@
+"""
+Completa los campos de búsqueda (emailLower/displayNameLower) en `users`.
+
+Uso:
+    python -m app.scripts.backfill_search_fields
+"""
+import time
+
+from app.services.users_service import backfill_search_fields
+
+def main() -> None:
+    t0 = time.perf_counter()
+    updated = backfill_search_fields()
+    elapsed = time.perf_counter() - t0
+    print(f"perfiles actualizados: {updated} ({elapsed:.1f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+"""
+Completa `updatedAt` en los docs de `users`/`roles` que no lo tienen (necesario para
+`/users/changes` y el ETag de `GET /users`).
+
+Uso:
+    python -m app.scripts.backfill_updated_at
+"""
+import time
+
+from app.services.sync_service import backfill_updated_at
+
+def main() -> None:
+    t0 = time.perf_counter()
+    stats = backfill_updated_at()
+    elapsed = time.perf_counter() - t0
+    print(f"docs actualizados: users={stats['users']}, roles={stats['roles']} ({elapsed:.1f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Importa carreras o usuarios pre-provisionados desde un CSV (idempotente).
+
+Uso:
+    python -m app.scripts.import_csv careers carreras.csv
+    python -m app.scripts.import_csv users usuarios.csv [--create-auth]
+"""
+import argparse
+import sys
+import time
+
+from app.services.import_service import import_careers, import_users
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=["careers", "users"], help="qué se importa")
+    parser.add_argument("path", help="archivo CSV (UTF-8, con encabezado)")
+    parser.add_argument("--create-auth", action="store_true",
+                        help="crear cuentas de Auth para emails sin cuenta (si no, quedan unresolved)")
+    args = parser.parse_args()
+
+    with open(args.path, encoding="utf-8-sig") as f:
+        text = f.read()
+
+    t0 = time.perf_counter()
+
+    def progress(done: int, total: int) -> None:
+        elapsed = time.perf_counter() - t0
+        rate = done / elapsed if elapsed > 0 else 0.0
+        print(f"\r{done}/{total} filas ({rate:.0f} filas/s)", end="", file=sys.stderr, flush=True)
+
+    if args.kind == "careers":
+        stats = import_careers(text, on_progress=progress)
+    else:
+        stats = import_users(text, on_progress=progress, create_auth=args.create_auth)
+    print(file=sys.stderr)
+
+    auth = f", cuentas Auth creadas {stats['auth_created']}" if "auth_created" in stats else ""
+    print(
+        f"{args.kind}: {stats['total']} filas, creados {stats['created']}, actualizados {stats['updated']}, "
+        f"omitidos {stats['skipped']}, fallidos {stats['failed']}{auth} "
+        f"({stats['elapsed_seconds']:.1f}s, {stats['rows_per_second'] or 0:.0f} filas/s)"
+    )
+    for err in stats["errors"]:
+        print(f"  fila {err['row']}: {err['error']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+"""
+Backfill / reconstrucción de la vista `principals` (users + roles).
+
+Uso:
+    python -m app.scripts.rebuild_principals
+"""
+import time
+
+from app.services.principals_service import rebuild_principals
+
+def main() -> None:
+    t0 = time.perf_counter()
+    stats = rebuild_principals()
+    elapsed = time.perf_counter() - t0
+    print(
+        f"principals reconstruidos: {stats['users']} con perfil, "
+        f"{stats['roles_only']} solo roles ({elapsed:.1f}s)"
+    )
+
+if __name__ == "__main__":
+    main()
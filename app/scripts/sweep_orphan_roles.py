@@ -0,0 +1,24 @@
+"""
+Borra en lote los docs de `roles` huérfanos (uid inexistente en Firebase Auth).
+
+Uso:
+    python -m app.scripts.sweep_orphan_roles [--dry-run]
+"""
+import argparse
+import time
+
+from app.services.deletion_service import sweep_orphan_roles
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dry-run", action="store_true", help="solo contar, no borrar")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    stats = sweep_orphan_roles(dry_run=args.dry_run)
+    elapsed = time.perf_counter() - t0
+    accion = "encontrados" if args.dry_run else "borrados"
+    print(f"roles revisados: {stats['scanned']}, huérfanos {accion}: {stats['orphans']} ({elapsed:.1f}s)")
+
+if __name__ == "__main__":
+    main()
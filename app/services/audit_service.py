@@ -0,0 +1,142 @@
+"""
+Audit log de cambios de roles con escritura diferida.
+
+`record` encola la entrada (sin I/O en el request); un thread de fondo la persiste en
+`audit_log` con batches de Firestore cuando se junta AUDIT_BATCH_SIZE o pasa
+AUDIT_FLUSH_INTERVAL_SECONDS. La cola es acotada: si se llena, `record` espera hasta
+AUDIT_ENQUEUE_TIMEOUT_SECONDS (backpressure) y luego descarta con log de error.
+"""
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from google.cloud import firestore
+
+from app.config import (
+    AUDIT_MAX_BUFFER,
+    AUDIT_BATCH_SIZE,
+    AUDIT_FLUSH_INTERVAL_SECONDS,
+    AUDIT_ENQUEUE_TIMEOUT_SECONDS,
+)
+from app.core.firebase import firestore_db
+
+logger = logging.getLogger(__name__)
+
+AUDIT_COLL = "audit_log"
+
+# Reintentos de un batch antes de descartarlo (la memoria sigue acotada)
+FLUSH_ATTEMPTS = 3
+
+class AuditWriter:
+    def __init__(self, max_buffer: int = AUDIT_MAX_BUFFER, batch_size: int = AUDIT_BATCH_SIZE,
+                 flush_interval: float = AUDIT_FLUSH_INTERVAL_SECONDS,
+                 enqueue_timeout: float = AUDIT_ENQUEUE_TIMEOUT_SECONDS):
+        self._queue: "queue.Queue[Dict]" = queue.Queue(maxsize=max_buffer)
+        self.batch_size = min(batch_size, 500)  # límite de Firestore por batch
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self.stats = {"enqueued": 0, "written": 0, "dropped": 0, "flushes": 0, "failed_flushes": 0}
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        Drena lo pendiente y detiene el thread (llamar en el shutdown).
+        """
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                logger.error("audit writer no terminó de drenar (%s pendientes)", self._queue.qsize())
+
+    def record(self, entry: Dict) -> bool:
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        try:
+            self._queue.put(entry, timeout=self.enqueue_timeout)
+        except queue.Full:
+            self.stats["dropped"] += 1
+            logger.error("audit log lleno, entrada descartada: %s", entry.get("action"))
+            return False
+        self.stats["enqueued"] += 1
+        return True
+
+    def _take_batch(self) -> List[Dict]:
+        items: List[Dict] = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(items) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if self._stopping.is_set():
+                # Drenar sin esperar
+                try:
+                    items.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                items.append(self._queue.get(timeout=min(remaining, 0.5)))
+            except queue.Empty:
+                continue
+        return items
+
+    def _flush(self, items: List[Dict]) -> None:
+        for attempt in range(1, FLUSH_ATTEMPTS + 1):
+            try:
+                batch = firestore_db.batch()
+                for entry in items:
+                    batch.set(firestore_db.collection(AUDIT_COLL).document(), entry)
+                batch.commit()
+                self.stats["written"] += len(items)
+                self.stats["flushes"] += 1
+                return
+            except Exception as e:
+                logger.warning("flush de audit log falló (intento %s/%s): %s", attempt, FLUSH_ATTEMPTS, e)
+                time.sleep(min(2 ** attempt, 5))
+        self.stats["failed_flushes"] += 1
+        self.stats["dropped"] += len(items)
+        logger.error("se descartaron %s entradas de audit log", len(items))
+
+    def _run(self) -> None:
+        while True:
+            items = self._take_batch()
+            if items:
+                self._flush(items)
+            elif self._stopping.is_set() and self._queue.empty():
+                return
+
+    def snapshot(self) -> Dict:
+        return {"pending": self._queue.qsize(), **self.stats}
+
+audit_writer = AuditWriter()
+
+def record_role_change(actor_uid: str, action: str, target_uid: str,
+                       before: Optional[Dict], after: Optional[Dict], career: Optional[str] = None) -> bool:
+    """
+    Encola quién cambió qué (estado de roles antes/después) sobre `target_uid`.
+    """
+    entry = {
+        "actor_uid": actor_uid,
+        "action": action,
+        "target_uid": target_uid,
+        "career": career,
+        "before": before,
+        "after": after,
+        "at": datetime.now(timezone.utc),
+        "writtenAt": firestore.SERVER_TIMESTAMP,
+    }
+    return audit_writer.record(entry)
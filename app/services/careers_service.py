@@ -1,27 +1,66 @@
+import threading
 from typing import Dict, List, Optional
 from google.cloud import firestore
 from app.core.firebase import firestore_db
 
 CAREERS_COLL = "careers"
 
+# Índice en memoria de carreras conocidas (code -> doc). Se calienta con list_careers
+# y se mantiene con las escrituras de este módulo.
+_known_careers: Dict[str, Dict] = {}
+_known_lock = threading.Lock()
+_warmed = False
+
+def normalize_code(code: Optional[str]) -> str:
+    return (code or "").strip().upper()
+
+def remember_career(code: str, data: Dict) -> None:
+    with _known_lock:
+        _known_careers[code] = data
+
 def list_careers() -> List[Dict]:
     """
     Devuelve una lista de carreras. Cada doc:
       { code: "SIS", name: "Ingeniería de Sistemas", createdAt, updatedAt }
     """
+    global _warmed
     docs = firestore_db.collection(CAREERS_COLL).order_by("code").stream()
     out = []
     for d in docs:
         data = d.to_dict() or {}
         data["id"] = d.id
         out.append(data)
+    with _known_lock:
+        _known_careers.clear()
+        _known_careers.update({c["id"]: c for c in out})
+        _warmed = True
     return out
 
+def career_exists(code: str) -> bool:
+    """
+    True si la carrera existe. Las carreras conocidas no cuestan ningún round trip;
+    un código desconocido se confirma con un único `get` (puede haberla creado otro worker).
+    """
+    code = normalize_code(code)
+    if not code:
+        return False
+    if not _warmed:
+        list_careers()
+    if code in _known_careers:
+        return True
+    doc = firestore_db.collection(CAREERS_COLL).document(code).get()
+    if not doc.exists:
+        return False
+    data = doc.to_dict() or {}
+    data["id"] = doc.id
+    remember_career(code, data)
+    return True
+
 def ensure_career(code: str, name: Optional[str] = None) -> Dict:
     """
     Crea (o mergea) una carrera. Idempotente.
     """
-    code = (code or "").strip().upper()
+    code = normalize_code(code)
     if not code:
         raise ValueError("code es obligatorio para career")
     ref = firestore_db.collection(CAREERS_COLL).document(code)
@@ -37,10 +76,12 @@ def ensure_career(code: str, name: Optional[str] = None) -> Dict:
     if not snap.exists:
         payload["createdAt"] = firestore.SERVER_TIMESTAMP
         ref.set(payload)
+        remember_career(code, {"id": code, "code": code, **({"name": name} if name else {})})
         return payload
 
     ref.set(payload, merge=True)
     current = snap.to_dict() or {}
+    remember_career(code, {**current, "id": code, **({"name": name} if name else {})})
     current.update(payload)
     return current
 
@@ -0,0 +1,279 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+from firebase_admin import auth as fb_auth
+from google.cloud import firestore
+
+from app.config import (
+    DELETION_MAX_ATTEMPTS,
+    DELETION_LEASE_SECONDS,
+    DELETION_SWEEP_INTERVAL_SECONDS,
+    DELETION_REDRIVE_MAX_DELAY_SECONDS,
+)
+from app.core.firebase import firestore_db
+from app.core.cache import roles_cache, profile_cache
+from app.services.users_service import COLLECTION as USERS_COLL
+from app.services.roles_service import ROLES_COLL
+from app.services.principals_service import PRINCIPALS_COLL
+from app.services.sync_service import TOMBSTONES_COLL, tombstone_payload
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLL = "deletion_jobs"
+
+# Colecciones con un doc por uid que se borran en cascada
+CASCADE_COLLS = (USERS_COLL, ROLES_COLL, PRINCIPALS_COLL)
+
+# Límite de get_users de Firebase Auth por llamada
+AUTH_LOOKUP_CHUNK = 100
+
+# Identidad de este worker como dueño de leases
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+@firestore.transactional
+def _enqueue_in_txn(transaction, ref, uid: str) -> Dict:
+    snap = ref.get(transaction=transaction)
+    if not snap.exists:
+        job = {
+            "uid": uid,
+            "status": "pending",
+            "attempts": 0,
+            "createdAt": firestore.SERVER_TIMESTAMP,
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+        }
+        transaction.set(ref, job)
+        return job
+    job = snap.to_dict() or {}
+    if job.get("status") == "failed":
+        # Un nuevo pedido adelanta el reintento; conserva attempts/rounds
+        update = {"status": "pending", "nextAttemptAt": firestore.DELETE_FIELD,
+                  "updatedAt": firestore.SERVER_TIMESTAMP}
+        transaction.update(ref, update)
+        job["status"] = "pending"
+    # pending / processing / done: no se toca (no se pisa un lease vigente)
+    return job
+
+def enqueue_deletion(uid: str) -> Dict:
+    """
+    Registra (de forma durable) un job de borrado para `uid`. Idempotente: crea el job
+    si no existe y no resetea uno en curso o terminado.
+    """
+    ref = firestore_db.collection(JOBS_COLL).document(uid)
+    return _enqueue_in_txn(firestore_db.transaction(), ref, uid)
+
+def _delete_docs(uid: str) -> None:
+    roles_snap = firestore_db.collection(ROLES_COLL).document(uid).get()
+    roles_doc = (roles_snap.to_dict() or {}) if roles_snap.exists else {}
+    # Un solo commit para todas las colecciones (borrar un doc inexistente no falla)
+    batch = firestore_db.batch()
+    for coll in CASCADE_COLLS:
+        batch.delete(firestore_db.collection(coll).document(uid))
+    # Tombstone para los clientes de /users/changes
+    batch.set(firestore_db.collection(TOMBSTONES_COLL).document(uid), tombstone_payload(uid, roles_doc))
+    batch.commit()
+    roles_cache.invalidate(uid)
+    profile_cache.invalidate(uid)
+
+def _delete_auth_user(uid: str) -> None:
+    try:
+        fb_auth.delete_user(uid)
+    except fb_auth.UserNotFoundError:
+        pass
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _claimable(job: Dict, now: datetime) -> bool:
+    status = job.get("status")
+    if status == "pending":
+        lease = job.get("leaseExpiresAt")
+        return lease is None or lease <= now
+    if status == "processing":
+        return (job.get("leaseExpiresAt") or now) <= now
+    if status == "failed":
+        return (job.get("nextAttemptAt") or now) <= now
+    return False
+
+@firestore.transactional
+def _claim_in_txn(transaction, ref) -> bool:
+    snap = ref.get(transaction=transaction)
+    if not snap.exists:
+        return False
+    now = _now()
+    if not _claimable(snap.to_dict() or {}, now):
+        return False
+    transaction.update(ref, {
+        "status": "processing",
+        "leaseOwner": WORKER_ID,
+        "leaseExpiresAt": now + timedelta(seconds=DELETION_LEASE_SECONDS),
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    })
+    return True
+
+@firestore.transactional
+def _extend_in_txn(transaction, ref) -> bool:
+    snap = ref.get(transaction=transaction)
+    if not snap.exists:
+        return False
+    job = snap.to_dict() or {}
+    if job.get("status") != "processing" or job.get("leaseOwner") != WORKER_ID:
+        return False
+    transaction.update(ref, {
+        "leaseExpiresAt": _now() + timedelta(seconds=DELETION_LEASE_SECONDS),
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    })
+    return True
+
+def extend_lease(uid: str) -> bool:
+    """
+    Renueva el lease de este worker sobre el job. False si lo perdió (otro lo tomó).
+    """
+    ref = firestore_db.collection(JOBS_COLL).document(uid)
+    return _extend_in_txn(firestore_db.transaction(), ref)
+
+def claim_deletion(uid: str) -> bool:
+    """
+    Toma el job de `uid` para este worker (transaccional). False si ya terminó,
+    si otro worker tiene el lease vigente o si un fallido aún no debe reintentarse.
+    """
+    ref = firestore_db.collection(JOBS_COLL).document(uid)
+    return _claim_in_txn(firestore_db.transaction(), ref)
+
+def _redrive_delay(rounds: int) -> int:
+    return min(DELETION_LEASE_SECONDS * (2 ** max(rounds - 1, 0)), DELETION_REDRIVE_MAX_DELAY_SECONDS)
+
+def process_deletion(uid: str, max_attempts: int = DELETION_MAX_ATTEMPTS) -> bool:
+    """
+    Ejecuta el borrado en cascada: cuenta de Auth + docs en users/roles/principals.
+    Solo lo hace quien toma el lease del job; reintenta con backoff exponencial y,
+    si se agotan los intentos, queda 'failed' con `nextAttemptAt` para el sweeper.
+    """
+    if not claim_deletion(uid):
+        return False
+    ref = firestore_db.collection(JOBS_COLL).document(uid)
+    last_error = None
+    for attempt in range(1, max_attempts + 1):
+        # El backoff puede superar el lease: se renueva antes de cada intento
+        if attempt > 1 and not extend_lease(uid):
+            logger.warning("lease del borrado de %s perdido; otro worker lo continúa", uid)
+            return False
+        try:
+            _delete_auth_user(uid)
+            _delete_docs(uid)
+            ref.set(
+                {
+                    "status": "done",
+                    "attempts": firestore.Increment(attempt),
+                    "leaseOwner": firestore.DELETE_FIELD,
+                    "leaseExpiresAt": firestore.DELETE_FIELD,
+                    "updatedAt": firestore.SERVER_TIMESTAMP,
+                },
+                merge=True,
+            )
+            return True
+        except Exception as e:
+            last_error = e
+            logger.warning("borrado de %s falló (intento %s/%s): %s", uid, attempt, max_attempts, e)
+            if attempt < max_attempts:
+                time.sleep(min(2 ** attempt, 30))
+
+    try:
+        snap = ref.get()
+        rounds = int((snap.to_dict() or {}).get("rounds") or 0) + 1
+        ref.set(
+            {
+                "status": "failed",
+                "attempts": firestore.Increment(max_attempts),
+                "rounds": rounds,
+                "lastError": str(last_error),
+                "nextAttemptAt": _now() + timedelta(seconds=_redrive_delay(rounds)),
+                "leaseOwner": firestore.DELETE_FIELD,
+                "leaseExpiresAt": firestore.DELETE_FIELD,
+                "updatedAt": firestore.SERVER_TIMESTAMP,
+            },
+            merge=True,
+        )
+    except Exception:
+        logger.exception("no se pudo marcar el job de borrado %s como fallido", uid)
+    return False
+
+def redrive_deletions() -> int:
+    """
+    Re-ejecuta los jobs 'pending', los 'processing' con lease vencido (worker muerto)
+    y los 'failed' cuyo `nextAttemptAt` ya pasó. El claim evita que dos workers
+    procesen el mismo job. Devuelve cuántos se completaron.
+    """
+    now = _now()
+    candidates = []
+    for status in ("pending", "processing", "failed"):
+        docs = (
+            firestore_db.collection(JOBS_COLL)
+            .where(filter=firestore.FieldFilter("status", "==", status))
+            .stream()
+        )
+        candidates.extend(d.id for d in docs if _claimable(d.to_dict() or {}, now))
+    return sum(1 for uid in candidates if process_deletion(uid))
+
+def run_deletion_sweeper(stop: threading.Event, interval: float = DELETION_SWEEP_INTERVAL_SECONDS) -> None:
+    """
+    Loop del sweeper (thread del lifespan): redrive al arrancar y luego cada `interval`.
+    """
+    while not stop.is_set():
+        try:
+            n = redrive_deletions()
+            if n:
+                logger.info("sweeper de borrados: %s jobs reprocesados", n)
+        except Exception:
+            logger.exception("sweeper de borrados falló")
+        stop.wait(interval)
+
+def _missing_in_auth(uids: List[str]) -> List[str]:
+    identifiers = [fb_auth.UidIdentifier(u) for u in uids]
+    result = fb_auth.get_users(identifiers)
+    return [i.uid for i in result.not_found]
+
+def sweep_orphan_roles(dry_run: bool = False, batch_size: int = 400) -> Dict[str, int]:
+    """
+    Borra en lote los docs de `roles` (y su principal) cuyo uid ya no existe en Firebase Auth.
+    """
+    stats = {"scanned": 0, "orphans": 0}
+    chunk: Dict[str, Dict] = {}
+    # uid -> roles al momento del barrido (van al tombstone)
+    orphans: Dict[str, Dict] = {}
+
+    def _check(docs: Dict[str, Dict]) -> None:
+        missing = _missing_in_auth(list(docs))
+        orphans.update((uid, docs[uid]) for uid in missing)
+        stats["orphans"] += len(missing)
+
+    for d in firestore_db.collection(ROLES_COLL).select(["roles", "admin_careers"]).stream():
+        stats["scanned"] += 1
+        chunk[d.id] = d.to_dict() or {}
+        if len(chunk) >= AUTH_LOOKUP_CHUNK:
+            _check(chunk)
+            chunk = {}
+    if chunk:
+        _check(chunk)
+
+    if dry_run:
+        return stats
+
+    # 3 escrituras por uid (roles + principals + tombstone)
+    per_batch = max(1, batch_size // 3)
+    uids = list(orphans)
+    for i in range(0, len(uids), per_batch):
+        batch = firestore_db.batch()
+        for uid in uids[i:i + per_batch]:
+            batch.delete(firestore_db.collection(ROLES_COLL).document(uid))
+            batch.delete(firestore_db.collection(PRINCIPALS_COLL).document(uid))
+            batch.set(firestore_db.collection(TOMBSTONES_COLL).document(uid), tombstone_payload(uid, orphans[uid]))
+        batch.commit()
+        for uid in uids[i:i + per_batch]:
+            roles_cache.invalidate(uid)
+    return stats
@@ -0,0 +1,283 @@
+"""
+Importación masiva (CSV) de carreras y de usuarios pre-provisionados.
+
+Cada chunk se lee con un solo get_all y se escribe con un batch; los chunks se
+commitean en paralelo (IMPORT_WORKERS). Todo es merge: re-ejecutar el mismo CSV
+no duplica ni pisa roles existentes (solo agrega 'student').
+
+CSV de carreras: columnas `code`, `name` (opcional).
+CSV de usuarios: columnas `uid` y/o `email`, `displayName`, `photoURL` (opcionales).
+Las filas sin uid se resuelven por email contra Firebase Auth; si el email no tiene
+cuenta la fila se reporta como `unresolved`. Opcionalmente (create_auth=True) se crea
+la cuenta (import_users, email sin verificar, sin providers). Cómo la vincula el login
+con Google depende de la configuración de cuentas del proyecto: probarlo antes de usarlo.
+"""
+import csv
+import io
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
+
+from firebase_admin import auth as fb_auth
+from google.cloud import firestore
+
+from app.config import IMPORT_BATCH_SIZE, IMPORT_WORKERS
+from app.core.cache import profile_cache, roles_cache
+from app.core.firebase import firestore_db
+from app.services.careers_service import CAREERS_COLL, normalize_code, remember_career
+from app.services.principals_service import PRINCIPALS_COLL, principal_payload
+from app.services.roles_service import ROLES_COLL
+from app.services.users_service import COLLECTION as USERS_COLL, with_search_fields
+
+logger = logging.getLogger(__name__)
+
+# Límites de Firebase Auth por llamada (get_users / import_users)
+AUTH_LOOKUP_CHUNK = 100
+AUTH_IMPORT_CHUNK = 1000
+# Escrituras por usuario: users + roles + principals
+WRITES_PER_USER = 3
+# Errores por fila que se devuelven en el reporte
+MAX_REPORTED_ERRORS = 50
+
+ProgressFn = Callable[[int, int], None]
+
+def _read_csv(text: str) -> List[Dict[str, str]]:
+    reader = csv.DictReader(io.StringIO(text.lstrip("\ufeff")))
+    if not reader.fieldnames:
+        raise ValueError("CSV vacío o sin encabezado")
+    reader.fieldnames = [(f or "").strip() for f in reader.fieldnames]
+    return [{k: (v or "").strip() for k, v in row.items() if k} for row in reader]
+
+def _chunks(items: List, size: int) -> List[List]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+class _Report:
+    """
+    Contadores compartidos entre los workers + progreso y throughput.
+    """
+    def __init__(self, total: int, on_progress: Optional[ProgressFn]):
+        self.total = total
+        self.on_progress = on_progress
+        self.stats = {"total": total, "created": 0, "updated": 0, "skipped": 0, "failed": 0}
+        self.errors: List[Dict] = []
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+
+    def add(self, **counts: int) -> None:
+        with self._lock:
+            for k, v in counts.items():
+                self.stats[k] = self.stats.get(k, 0) + v
+            done = sum(self.stats[k] for k in ("created", "updated", "skipped", "failed"))
+        if self.on_progress:
+            self.on_progress(done, self.total)
+
+    def error(self, row: int, reason: str) -> None:
+        with self._lock:
+            if len(self.errors) < MAX_REPORTED_ERRORS:
+                self.errors.append({"row": row, "error": reason})
+
+    def result(self) -> Dict:
+        elapsed = time.perf_counter() - self._t0
+        written = self.stats["created"] + self.stats["updated"]
+        return {
+            **self.stats,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(written / elapsed, 1) if elapsed > 0 else None,
+            "errors": self.errors,
+        }
+
+def _run_parallel(chunks: List, write_chunk: Callable, report: _Report) -> None:
+    with ThreadPoolExecutor(max_workers=max(1, IMPORT_WORKERS)) as pool:
+        futures = {pool.submit(write_chunk, chunk): chunk for chunk in chunks}
+        for fut in as_completed(futures):
+            try:
+                fut.result()
+            except Exception as e:
+                chunk = futures[fut]
+                logger.warning("import: falló un batch de %s filas: %s", len(chunk), e)
+                report.add(failed=len(chunk))
+                for row_no, *_ in chunk:
+                    report.error(row_no, f"batch falló: {e}")
+
+# ====== CARRERAS ======
+def import_careers(text: str, on_progress: Optional[ProgressFn] = None) -> Dict:
+    rows: Dict[str, Tuple[int, Dict]] = {}
+    skipped: List[Tuple[int, str]] = []
+    for i, raw in enumerate(_read_csv(text), start=2):  # fila 1 = encabezado
+        code = normalize_code(raw.get("code"))
+        if not code:
+            skipped.append((i, "code es obligatorio para career"))
+            continue
+        # Código repetido en el CSV: gana la última fila
+        rows[code] = (i, {"code": code, "name": raw.get("name") or None})
+
+    report = _Report(len(rows) + len(skipped), on_progress)
+    for row_no, reason in skipped:
+        report.error(row_no, reason)
+    if skipped:
+        report.add(skipped=len(skipped))
+
+    def _write(chunk: List[Tuple[int, Dict]]) -> None:
+        refs = [firestore_db.collection(CAREERS_COLL).document(c["code"]) for _, c in chunk]
+        existing = {s.id: (s.to_dict() or {}) for s in firestore_db.get_all(refs) if s.exists}
+        batch = firestore_db.batch()
+        for ref, (_, c) in zip(refs, chunk):
+            payload = {"code": c["code"], "updatedAt": firestore.SERVER_TIMESTAMP}
+            if c["name"]:
+                payload["name"] = c["name"]
+            if c["code"] not in existing:
+                payload["createdAt"] = firestore.SERVER_TIMESTAMP
+            batch.set(ref, payload, merge=True)
+        batch.commit()
+        for _, c in chunk:
+            known = existing.get(c["code"], {})
+            remember_career(
+                c["code"], {**known, "id": c["code"], "code": c["code"], **({"name": c["name"]} if c["name"] else {})}
+            )
+        created = sum(1 for _, c in chunk if c["code"] not in existing)
+        report.add(created=created, updated=len(chunk) - created)
+
+    _run_parallel(_chunks(list(rows.values()), min(IMPORT_BATCH_SIZE, 500)), _write, report)
+    return report.result()
+
+# ====== USUARIOS ======
+def _resolve_emails(emails: List[str]) -> Dict[str, str]:
+    """
+    email (minúsculas) -> uid, consultando Firebase Auth de a AUTH_LOOKUP_CHUNK.
+    """
+    found: Dict[str, str] = {}
+    for chunk in _chunks(emails, AUTH_LOOKUP_CHUNK):
+        result = fb_auth.get_users([fb_auth.EmailIdentifier(e) for e in chunk])
+        for u in result.users:
+            if u.email:
+                found[u.email.lower()] = u.uid
+    return found
+
+def _create_auth_users(rows: List[Tuple[int, Dict[str, str]]]) -> Tuple[Dict[str, str], List[Tuple[int, str]]]:
+    """
+    Crea en Firebase Auth las cuentas de las filas dadas (una por email).
+    Devuelve (email en minúsculas -> uid nuevo, errores por fila).
+    """
+    created: Dict[str, str] = {}
+    errors: List[Tuple[int, str]] = []
+    for chunk in _chunks(rows, AUTH_IMPORT_CHUNK):
+        records = [
+            fb_auth.ImportUserRecord(
+                uid=uuid.uuid4().hex,
+                email=raw["email"].lower(),
+                display_name=raw.get("displayName") or None,
+                photo_url=raw.get("photoURL") or None,
+            )
+            for _, raw in chunk
+        ]
+        try:
+            result = fb_auth.import_users(records)
+        except Exception as e:
+            logger.warning("import: falló la creación de %s cuentas de Auth: %s", len(chunk), e)
+            errors.extend((row_no, f"no se pudo crear la cuenta de {raw['email']}: {e}") for row_no, raw in chunk)
+            continue
+        failed = {e.index: e.reason for e in result.errors}
+        for idx, ((row_no, raw), rec) in enumerate(zip(chunk, records)):
+            if idx in failed:
+                errors.append((row_no, f"no se pudo crear la cuenta de {raw['email']}: {failed[idx]}"))
+            else:
+                created[raw["email"].lower()] = rec.uid
+    return created, errors
+
+def _profile_from_row(raw: Dict[str, str]) -> Dict:
+    return {k: raw[k] for k in ("email", "displayName", "photoURL") if raw.get(k)}
+
+def import_users(text: str, on_progress: Optional[ProgressFn] = None, create_auth: bool = False) -> Dict:
+    parsed: List[Tuple[int, Dict[str, str]]] = []
+    skipped: List[Tuple[int, str]] = []
+    for i, raw in enumerate(_read_csv(text), start=2):
+        if not raw.get("uid") and not raw.get("email"):
+            skipped.append((i, "se requiere uid o email"))
+            continue
+        parsed.append((i, raw))
+
+    to_lookup = sorted({raw["email"].lower() for _, raw in parsed if not raw.get("uid")})
+    by_email = _resolve_emails(to_lookup) if to_lookup else {}
+
+    # Emails sin cuenta: solo a pedido se crean en Auth para tener el uid antes del primer login
+    auth_created = 0
+    if create_auth:
+        missing: Dict[str, Tuple[int, Dict[str, str]]] = {}
+        for i, raw in parsed:
+            email = (raw.get("email") or "").lower()
+            if not raw.get("uid") and email not in by_email:
+                missing.setdefault(email, (i, raw))
+        if missing:
+            new_uids, auth_errors = _create_auth_users(list(missing.values()))
+            by_email.update(new_uids)
+            auth_created = len(new_uids)
+            skipped.extend(auth_errors)
+            failed_rows = {row_no for row_no, _ in auth_errors}
+            parsed = [(i, raw) for i, raw in parsed if i not in failed_rows]
+
+    rows: Dict[str, Tuple[int, Dict]] = {}
+    unresolved = 0
+    for i, raw in parsed:
+        uid = raw.get("uid") or by_email.get(raw["email"].lower())
+        if not uid:
+            unresolved += 1
+            skipped.append((i, f"email sin usuario en Firebase Auth: {raw['email']}"))
+            continue
+        rows[uid] = (i, {"uid": uid, "profile": _profile_from_row(raw)})
+
+    report = _Report(len(rows) + len(skipped), on_progress)
+    report.stats["unresolved"] = unresolved
+    report.stats["auth_created"] = auth_created
+    for row_no, reason in skipped:
+        report.error(row_no, reason)
+    if skipped:
+        report.add(skipped=len(skipped))
+
+    def _write(chunk: List[Tuple[int, Dict]]) -> None:
+        uids = [u["uid"] for _, u in chunk]
+        user_refs = [firestore_db.collection(USERS_COLL).document(uid) for uid in uids]
+        role_refs = [firestore_db.collection(ROLES_COLL).document(uid) for uid in uids]
+        snaps = {(s.reference.path): s for s in firestore_db.get_all(user_refs + role_refs)}
+        batch = firestore_db.batch()
+        created = 0
+        for (_, u), uref, rref in zip(chunk, user_refs, role_refs):
+            uid, profile = u["uid"], u["profile"]
+            usnap, rsnap = snaps.get(uref.path), snaps.get(rref.path)
+            user_exists = usnap is not None and usnap.exists
+            roles_exists = rsnap is not None and rsnap.exists
+
+            user_payload = {**with_search_fields(profile), "updatedAt": firestore.SERVER_TIMESTAMP}
+            if not user_exists:
+                user_payload["createdAt"] = firestore.SERVER_TIMESTAMP
+                created += 1
+            batch.set(uref, user_payload, merge=True)
+
+            # Igual que ensure_default_student, sin pisar roles/admin_careers existentes
+            if roles_exists:
+                rdoc = rsnap.to_dict() or {}
+                rdoc["roles"] = sorted(set((rdoc.get("roles") or []) + ["student"]))
+                batch.set(rref, {"roles": firestore.ArrayUnion(["student"]),
+                                 "updatedAt": firestore.SERVER_TIMESTAMP}, merge=True)
+            else:
+                rdoc = {"uid": uid, "roles": ["student"], "admin_careers": [], "platform_admin": False}
+                batch.set(rref, {**rdoc, "createdAt": firestore.SERVER_TIMESTAMP,
+                                 "updatedAt": firestore.SERVER_TIMESTAMP})
+
+            merged_profile = {**((usnap.to_dict() or {}) if user_exists else {}), **with_search_fields(profile)}
+            batch.set(
+                firestore_db.collection(PRINCIPALS_COLL).document(uid),
+                principal_payload(uid, merged_profile, rdoc),
+                merge=True,
+            )
+        batch.commit()
+        for uid in uids:
+            profile_cache.invalidate(uid)
+            roles_cache.invalidate(uid)
+        report.add(created=created, updated=len(chunk) - created)
+
+    chunk_size = max(1, min(IMPORT_BATCH_SIZE, 500) // WRITES_PER_USER)
+    _run_parallel(_chunks(list(rows.values()), chunk_size), _write, report)
+    return report.result()
@@ -0,0 +1,150 @@
+from typing import Dict, Iterator, List, Optional
+from google.cloud import firestore
+from app.core.firebase import firestore_db
+
+PRINCIPALS_COLL = "principals"
+
+# Campos del perfil que se copian al nivel raíz del principal
+PROFILE_FIELDS = ("email", "displayName", "photoURL")
+
+def _profile_part(uid: str, profile: Dict) -> Dict:
+    part = {"uid": uid, "profile": {**profile, "uid": uid}}
+    for k in PROFILE_FIELDS:
+        if k in profile:
+            part[k] = profile.get(k)
+    return part
+
+def _roles_part(uid: str, roles_doc: Dict) -> Dict:
+    return {
+        "uid": uid,
+        "roles": roles_doc.get("roles") or ["student"],
+        "admin_careers": roles_doc.get("admin_careers") or [],
+        "platform_admin": bool(roles_doc.get("platform_admin")),
+    }
+
+def principal_payload(uid: str, profile: Dict, roles_doc: Dict) -> Dict:
+    """
+    Principal completo (perfil + roles) para escribir en un batch.
+    """
+    return {
+        **_profile_part(uid, profile),
+        **_roles_part(uid, roles_doc),
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    }
+
+def sync_profile(uid: str, profile: Dict) -> None:
+    """
+    Copia el perfil (colección `users`) al principal del usuario. Merge: no pisa los roles.
+    """
+    firestore_db.collection(PRINCIPALS_COLL).document(uid).set(
+        {**_profile_part(uid, profile), "updatedAt": firestore.SERVER_TIMESTAMP},
+        merge=True,
+    )
+
+def sync_roles(uid: str, roles_doc: Dict) -> None:
+    """
+    Copia roles/admin_careers/platform_admin (colección `roles`) al principal del usuario.
+    """
+    firestore_db.collection(PRINCIPALS_COLL).document(uid).set(
+        {**_roles_part(uid, roles_doc), "updatedAt": firestore.SERVER_TIMESTAMP},
+        merge=True,
+    )
+
+def clear_profile(uid: str) -> None:
+    """
+    Quita la parte de perfil del principal (el doc de roles puede seguir existiendo).
+    """
+    firestore_db.collection(PRINCIPALS_COLL).document(uid).set(
+        {
+            "profile": firestore.DELETE_FIELD,
+            **{k: firestore.DELETE_FIELD for k in PROFILE_FIELDS},
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+        },
+        merge=True,
+    )
+
+def get_principal(uid: str) -> Optional[Dict]:
+    doc = firestore_db.collection(PRINCIPALS_COLL).document(uid).get()
+    return doc.to_dict() if doc.exists else None
+
+def stream_principals() -> Iterator[Dict]:
+    """
+    Recorre los principales que tienen perfil (los docs con solo roles son
+    usuarios que nunca materializaron perfil, igual que en el join original).
+    """
+    for doc in firestore_db.collection(PRINCIPALS_COLL).stream():
+        data = doc.to_dict() or {}
+        if "profile" not in data:
+            continue
+        data["uid"] = doc.id
+        yield data
+
+def iter_principal_pages(chunk_size: int) -> Iterator[List[Dict]]:
+    """
+    Igual que stream_principals pero por páginas (orden por id), para exports en streaming.
+    """
+    query = firestore_db.collection(PRINCIPALS_COLL).order_by("__name__").limit(chunk_size)
+    last = None
+    while True:
+        page_query = query.start_after(last) if last is not None else query
+        docs = list(page_query.stream())
+        if not docs:
+            return
+        page = []
+        for d in docs:
+            data = d.to_dict() or {}
+            if "profile" in data:
+                data["uid"] = d.id
+                page.append(data)
+        yield page
+        if len(docs) < chunk_size:
+            return
+        last = docs[-1]
+
+def rebuild_principals(batch_size: int = 400) -> Dict[str, int]:
+    """
+    Reconstruye la colección `principals` a partir de `users` + `roles`.
+    Idempotente: se puede correr como backfill o para reparar inconsistencias.
+    """
+    from app.services.users_service import COLLECTION as USERS_COLL
+    from app.services.roles_service import ROLES_COLL
+
+    roles_map: Dict[str, Dict] = {
+        d.id: (d.to_dict() or {}) for d in firestore_db.collection(ROLES_COLL).stream()
+    }
+
+    stats = {"users": 0, "roles_only": 0}
+    batch = firestore_db.batch()
+    pending = 0
+
+    def _flush():
+        nonlocal batch, pending
+        if pending:
+            batch.commit()
+        batch = firestore_db.batch()
+        pending = 0
+
+    seen = set()
+    for doc in firestore_db.collection(USERS_COLL).stream():
+        uid = doc.id
+        seen.add(uid)
+        payload = principal_payload(uid, doc.to_dict() or {}, roles_map.get(uid) or {})
+        # Sin merge: el principal queda exactamente como el join actual
+        batch.set(firestore_db.collection(PRINCIPALS_COLL).document(uid), payload)
+        stats["users"] += 1
+        pending += 1
+        if pending >= batch_size:
+            _flush()
+
+    for uid, rdoc in roles_map.items():
+        if uid in seen:
+            continue
+        payload = {**_roles_part(uid, rdoc), "updatedAt": firestore.SERVER_TIMESTAMP}
+        batch.set(firestore_db.collection(PRINCIPALS_COLL).document(uid), payload)
+        stats["roles_only"] += 1
+        pending += 1
+        if pending >= batch_size:
+            _flush()
+
+    _flush()
+    return stats
@@ -1,13 +1,50 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 from google.cloud import firestore
 from app.core.firebase import firestore_db
-from app.services.careers_service import ensure_career
+from app.core.cache import roles_cache
+from app.services.careers_service import career_exists, normalize_code
+from app.services import principals_service
+from app.services.audit_service import record_role_change
+import logging
+
+logger = logging.getLogger(__name__)
+
 ROLES_COLL = "roles"
 
+def _sync_principal(uid: str, data: Dict) -> Dict:
+    roles_cache.invalidate(uid)
+    # La vista `principals` es derivada: si falla, se repara con rebuild_principals
+    try:
+        principals_service.sync_roles(uid, data)
+    except Exception as e:
+        logger.warning("sync principal (roles) falló para %s: %s", uid, e)
+    return data
+
+def _role_state(d: Optional[Dict]) -> Optional[Dict]:
+    if d is None:
+        return None
+    return {
+        "roles": sorted(d.get("roles") or []),
+        "admin_careers": sorted(d.get("admin_careers") or []),
+        "platform_admin": bool(d.get("platform_admin")),
+    }
+
+def _audited(actor: Optional[str], action: str, target_uid: str, snap, data: Dict,
+             career: Optional[str] = None) -> Dict:
+    # Solo cambios hechos por un usuario (actor) quedan en el audit log; no hace I/O aquí
+    if actor:
+        before = _role_state(snap.to_dict()) if snap.exists else None
+        try:
+            record_role_change(actor, action, target_uid, before, _role_state(data), career)
+        except Exception as e:
+            logger.warning("audit de %s sobre %s falló: %s", action, target_uid, e)
+    return data
+
 def ensure_default_student(uid: str) -> Dict:
     """
     Garantiza que el usuario tenga un doc en `roles` con al menos el rol 'student'.
-    Si el doc no existe, lo crea. Si existe pero no contiene 'student', lo agrega.
+    Si el doc no existe, lo crea. Si existe pero no contiene 'student', lo agrega;
+    si ya lo contiene no escribe nada.
     """
     ref = firestore_db.collection(ROLES_COLL).document(uid)
     snap = ref.get()
@@ -22,9 +59,12 @@ def ensure_default_student(uid: str) -> Dict:
             "updatedAt": firestore.SERVER_TIMESTAMP,
         }
         ref.set(data)
-        return data
+        return _sync_principal(uid, data)
 
     data = snap.to_dict() or {}
+    if "student" in (data.get("roles") or []):
+        # Ya provisionado (login repetido o import): sin escrituras
+        return data
     roles: List[str] = list(set((data.get("roles") or []) + ["student"]))
     update = {
         "roles": roles,
@@ -32,40 +72,45 @@ def ensure_default_student(uid: str) -> Dict:
     }
     ref.set(update, merge=True)
     data.update(update)
-    return data
+    return _sync_principal(uid, data)
 
-def get_roles(uid: str) -> Dict:
+def _load_roles(uid: str) -> Dict:
     snap = firestore_db.collection(ROLES_COLL).document(uid).get()
     return snap.to_dict() if snap.exists else {"uid": uid, "roles": ["student"], "admin_careers": []}
 
-def is_platform_admin(uid: str) -> bool:
-    doc = get_roles(uid)
+def get_roles(uid: str, fresh: bool = False) -> Dict:
+    # fresh=True lee Firestore directo (chequeos de permisos antes de escribir)
+    if fresh:
+        return _load_roles(uid)
+    return roles_cache.get_or_load(uid, lambda: _load_roles(uid))
+
+def is_platform_admin(uid: str, fresh: bool = False) -> bool:
+    doc = get_roles(uid, fresh=fresh)
     return bool(doc.get("platform_admin"))
 
-def can_manage_career(uid: str, career: str) -> bool:
+def can_manage_career(uid: str, career: str, fresh: bool = False) -> bool:
     """
     Un platform_admin puede todo. Un admin solo puede asignar/quitar dentro de sus propias carreras.
     """
-    if is_platform_admin(uid):
+    doc = get_roles(uid, fresh=fresh)
+    if doc.get("platform_admin"):
         return True
-    doc = get_roles(uid)
     roles = doc.get("roles") or []
     if "admin" not in roles:
         return False
-    admin_careers = set(doc.get("admin_careers") or [])
-    return career in admin_careers
+    admin_careers = {normalize_code(c) for c in (doc.get("admin_careers") or [])}
+    return normalize_code(career) in admin_careers
 
-def add_admin_for_career(target_uid: str, career: str) -> Dict:
+def add_admin_for_career(target_uid: str, career: str, actor: Optional[str] = None) -> Dict:
     """
     Agrega rol 'admin' y la carrera en admin_careers del usuario objetivo.
-    Idempotente. Asegura que la carrera exista en la colección careers.
+    Idempotente. La carrera debe existir en la colección careers (ValueError si no).
     """
-    # ⬅️ asegura que la carrera exista (no falla si ya existe)
-    try:
-        ensure_career(career)
-    except Exception:
-        # si quieres, ignora errores silenciosamente o propaga
-        pass
+    # Se guarda el código normalizado (el mismo que valida career_exists)
+    career = normalize_code(career)
+    # Índice en memoria: carreras ya conocidas no cuestan round trips
+    if not career or not career_exists(career):
+        raise ValueError(f"La carrera '{career}' no existe.")
 
     ref = firestore_db.collection(ROLES_COLL).document(target_uid)
     snap = ref.get()
@@ -82,15 +127,16 @@ def add_admin_for_career(target_uid: str, career: str) -> Dict:
     }
     ref.set(update, merge=True)
     data.update(update)
-    return data
+    return _audited(actor, "add_admin", target_uid, snap, _sync_principal(target_uid, data), career)
 
-def remove_admin_for_career(target_uid: str, career: str) -> Dict:
+def remove_admin_for_career(target_uid: str, career: str, actor: Optional[str] = None) -> Dict:
     """
     Quita la carrera de `admin_careers` del usuario objetivo. Si después de quitarla
     ya no quedan carreras administradas, se remueve el rol 'admin'.
     Siempre garantiza que 'student' esté presente.
     Idempotente: si la carrera no estaba, no falla.
     """
+    career = normalize_code(career)
     ref = firestore_db.collection(ROLES_COLL).document(target_uid)
     snap = ref.get()
 
@@ -104,16 +150,15 @@ def remove_admin_for_career(target_uid: str, career: str) -> Dict:
             "updatedAt": firestore.SERVER_TIMESTAMP,
         }
         ref.set(data, merge=True)
-        return data
+        return _audited(actor, "remove_admin", target_uid, snap, _sync_principal(target_uid, data), career)
 
     data = snap.to_dict() or {}
     roles: List[str] = list(data.get("roles") or [])
     admin_careers = set(data.get("admin_careers") or [])
     platform_admin = bool(data.get("platform_admin"))
 
-    # Quitar la carrera (si existe)
-    if career in admin_careers:
-        admin_careers.remove(career)
+    # Quitar la carrera (si existe; también valores viejos sin normalizar como " sis ")
+    admin_careers = {c for c in admin_careers if normalize_code(c) != career}
 
     # Si ya no administra ninguna carrera, quitar 'admin'
     if not admin_careers and "admin" in roles:
@@ -132,10 +177,10 @@ def remove_admin_for_career(target_uid: str, career: str) -> Dict:
     }
     ref.set(update, merge=True)
     data.update(update)
-    return data
+    return _audited(actor, "remove_admin", target_uid, snap, _sync_principal(target_uid, data), career)
 
 # (Opcional) para revocar admin en todas las carreras de un tirón
-def remove_admin_all_careers(target_uid: str) -> Dict:
+def remove_admin_all_careers(target_uid: str, actor: Optional[str] = None) -> Dict:
     """
     Limpia todas las carreras administradas y quita el rol 'admin'.
     Mantiene 'student'. No toca 'platform_admin'.
@@ -151,7 +196,7 @@ def remove_admin_all_careers(target_uid: str) -> Dict:
             "updatedAt": firestore.SERVER_TIMESTAMP,
         }
         ref.set(data, merge=True)
-        return data
+        return _audited(actor, "remove_admin_all", target_uid, snap, _sync_principal(target_uid, data))
 
     data = snap.to_dict() or {}
     roles = [r for r in (data.get("roles") or []) if r != "admin"]
@@ -167,9 +212,9 @@ def remove_admin_all_careers(target_uid: str) -> Dict:
     }
     ref.set(update, merge=True)
     data.update(update)
-    return data
+    return _audited(actor, "remove_admin_all", target_uid, snap, _sync_principal(target_uid, data))
 
-def make_platform_admin(target_uid: str) -> Dict:
+def make_platform_admin(target_uid: str, actor: Optional[str] = None) -> Dict:
     """
     Convierte al usuario en Platform Admin.
     """
@@ -185,7 +230,7 @@ def make_platform_admin(target_uid: str) -> Dict:
             "updatedAt": firestore.SERVER_TIMESTAMP,
         }
         ref.set(data)
-        return data
+        return _audited(actor, "make_platform_admin", target_uid, snap, _sync_principal(target_uid, data))
 
     data = snap.to_dict() or {}
     # Aseguramos student por si acaso
@@ -198,9 +243,9 @@ def make_platform_admin(target_uid: str) -> Dict:
     }
     ref.set(update, merge=True)
     data.update(update)
-    return data
+    return _audited(actor, "make_platform_admin", target_uid, snap, _sync_principal(target_uid, data))
 
-def remove_platform_admin(target_uid: str) -> Dict:
+def remove_platform_admin(target_uid: str, actor: Optional[str] = None) -> Dict:
     """
     Quita el privilegio de Platform Admin.
     Si el usuario no tiene carreras administradas, se le quita el rol 'admin'
@@ -210,7 +255,7 @@ def remove_platform_admin(target_uid: str) -> Dict:
     snap = ref.get()
     
     if not snap.exists:
-        return ensure_default_student(target_uid)
+        return _audited(actor, "remove_platform_admin", target_uid, snap, ensure_default_student(target_uid))
 
     data = snap.to_dict() or {}
     roles = list(data.get("roles") or [])
@@ -231,4 +276,4 @@ def remove_platform_admin(target_uid: str) -> Dict:
     }
     ref.set(update, merge=True)
     data.update(update)
-    return data
+    return _audited(actor, "remove_platform_admin", target_uid, snap, _sync_principal(target_uid, data))
@@ -0,0 +1,162 @@
+"""
+Session cookies: emisión compartida con el login y renovación deslizante.
+
+Una cookie válida a la que le quedan menos de SESSION_RENEW_WINDOW_MINUTES se
+re-emite en un request normal: custom token -> ID token (signInWithCustomToken)
+-> nueva session cookie. get_current_user la deja en `request.state` y
+SessionRenewalMiddleware agrega el Set-Cookie a la respuesta real (también a 304,
+streaming o cualquier Response que devuelva el handler). La marca de rate limit por uid
+(SESSION_RENEW_MIN_INTERVAL_SECONDS) se escribe recién al entregar la cookie. Nunca
+se renueva más allá de SESSION_RENEW_MAX_HOURS desde el login original (claim `sess_start`).
+"""
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from fastapi import Response
+from firebase_admin import auth as fb_auth
+
+from app.config import (
+    FIREBASE_WEB_API_KEY,
+    SESSION_COOKIE_NAME,
+    SESSION_COOKIE_SECURE,
+    SESSION_EXPIRES_DELTA,
+    SESSION_RENEW_ENABLED,
+    SESSION_RENEW_WINDOW_MINUTES,
+    SESSION_RENEW_MIN_INTERVAL_SECONDS,
+    SESSION_RENEW_MAX_HOURS,
+)
+from app.core.cache import session_renew_marks
+from app.core.tracing import span
+
+logger = logging.getLogger(__name__)
+
+SIGN_IN_WITH_CUSTOM_TOKEN_URL = "https://identitytoolkit.googleapis.com/v1/accounts:signInWithCustomToken"
+
+# Claim propio con el inicio de la sesión original (se conserva entre renovaciones)
+SESSION_START_CLAIM = "sess_start"
+
+# Clave en request.state con (uid, cookie nueva) pendiente de entregar
+RENEWAL_STATE_KEY = "renewed_session"
+
+# uid -> inicio de una renovación en curso o aún no entregada en este worker
+_in_flight: Dict[str, float] = {}
+_in_flight_lock = threading.Lock()
+# Una renovación que nunca se entregó (request abortado) deja de bloquear tras este tiempo
+IN_FLIGHT_STALE_SECONDS = 60
+
+def set_session_cookie(response: Response, session_cookie: str) -> datetime:
+    """
+    Setea la session cookie en la respuesta; devuelve su expiración.
+    """
+    expires_at = datetime.now(timezone.utc) + SESSION_EXPIRES_DELTA
+    response.set_cookie(
+        key=SESSION_COOKIE_NAME,
+        value=session_cookie,
+        httponly=True,
+        secure=SESSION_COOKIE_SECURE,
+        samesite="lax",
+        path="/",
+        expires=expires_at,
+    )
+    return expires_at
+
+def _session_start(claims: Dict) -> int:
+    return int(claims.get(SESSION_START_CLAIM) or claims.get("auth_time") or claims.get("iat") or 0)
+
+def should_renew(claims: Dict) -> bool:
+    """
+    True si la cookie está dentro de la ventana de renovación y la sesión no superó el máximo.
+    """
+    if not SESSION_RENEW_ENABLED:
+        return False
+    now = time.time()
+    remaining = int(claims.get("exp", 0)) - now
+    if remaining <= 0 or remaining > SESSION_RENEW_WINDOW_MINUTES * 60:
+        return False
+    return now - _session_start(claims) < SESSION_RENEW_MAX_HOURS * 3600
+
+def _mint_session_cookie(uid: str, claims: Dict) -> str:
+    custom_token = fb_auth.create_custom_token(uid, {SESSION_START_CLAIM: _session_start(claims)})
+    if isinstance(custom_token, bytes):
+        custom_token = custom_token.decode()
+    with span("identitytoolkit.signInWithCustomToken"):
+        r = httpx.post(
+            SIGN_IN_WITH_CUSTOM_TOKEN_URL,
+            params={"key": FIREBASE_WEB_API_KEY},
+            json={"token": custom_token, "returnSecureToken": True},
+            timeout=10,
+        )
+    r.raise_for_status()
+    id_token = r.json()["idToken"]
+    with span("fb_auth.create_session_cookie", "renew"):
+        return fb_auth.create_session_cookie(id_token, expires_in=SESSION_EXPIRES_DELTA)
+
+def renew_session(uid: str, claims: Dict) -> Optional[str]:
+    """
+    Emite una nueva session cookie para `uid`, o None si ya se renovó hace poco (este u
+    otro worker), si hay otra renovación en curso o si falla (la cookie actual sigue valiendo).
+    Quien entrega la cookie debe llamar a `mark_renewed`.
+    """
+    now = time.monotonic()
+    with _in_flight_lock:
+        started = _in_flight.get(uid)
+        if started is not None and now - started < IN_FLIGHT_STALE_SECONDS:
+            return None
+        _in_flight[uid] = now
+    if session_renew_marks.is_set(uid):
+        _release(uid)
+        return None
+    try:
+        return _mint_session_cookie(uid, claims)
+    except Exception as e:
+        logger.warning("renovación de sesión falló para %s: %s", uid, e)
+        # Sin cookie que entregar: se marca igual para no reintentar en cada request
+        mark_renewed(uid)
+        return None
+
+def _release(uid: str) -> None:
+    with _in_flight_lock:
+        _in_flight.pop(uid, None)
+
+def mark_renewed(uid: str) -> None:
+    session_renew_marks.set(uid, SESSION_RENEW_MIN_INTERVAL_SECONDS)
+    _release(uid)
+
+def _cookie_headers(session_cookie: str) -> List[Tuple[bytes, bytes]]:
+    carrier = Response()
+    set_session_cookie(carrier, session_cookie)
+    return [(k, v) for k, v in carrier.raw_headers if k == b"set-cookie"]
+
+class SessionRenewalMiddleware:
+    """
+    Middleware ASGI: si el request renovó la sesión, agrega el Set-Cookie al inicio de
+    la respuesta (sea cual sea el Response del handler) y después marca el rate limit.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # El dict de state es el mismo que ve request.state en la dependencia
+        scope.setdefault("state", {})
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                renewed = scope.get("state", {}).pop(RENEWAL_STATE_KEY, None)
+                if renewed:
+                    uid, cookie = renewed
+                    message = {**message, "headers": list(message.get("headers", [])) + _cookie_headers(cookie)}
+                    await send(message)
+                    await asyncio.to_thread(mark_renewed, uid)
+                    return
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from google.cloud import firestore
+
+from app.config import SYNC_OVERLAP_SECONDS
+from app.core.firebase import firestore_db
+from app.services.users_service import COLLECTION as USERS_COLL
+from app.services.roles_service import ROLES_COLL
+
+TOMBSTONES_COLL = "tombstones"
+
+def tombstone_payload(uid: str, roles_doc: Optional[Dict] = None) -> Dict:
+    # Roles al momento del borrado: /users/changes aplica la misma visibilidad que a las filas
+    roles_doc = roles_doc or {}
+    return {
+        "uid": uid,
+        "deletedAt": firestore.SERVER_TIMESTAMP,
+        "roles": roles_doc.get("roles") or ["student"],
+        "admin_careers": roles_doc.get("admin_careers") or [],
+    }
+
+def _changed(coll: str, field: str, since: datetime) -> Dict[str, Dict]:
+    docs = (
+        firestore_db.collection(coll)
+        .where(filter=firestore.FieldFilter(field, ">", since))
+        .stream()
+    )
+    return {d.id: (d.to_dict() or {}) for d in docs}
+
+def changes_since(since: datetime) -> Tuple[List[Tuple[str, Dict, Dict]], List[Dict], datetime]:
+    """
+    Cambios en `users`/`roles` (por updatedAt) y tombstones de borrado posteriores a `since`.
+    Devuelve (filas (uid, perfil, roles), borrados con sus roles al borrarse, nuevo watermark).
+
+    Semántica al-menos-una-vez: el watermark es el inicio de la lectura menos
+    SYNC_OVERLAP_SECONDS, así un commit concurrente o un desfase de reloj no se pierde;
+    los clientes deben aplicar los cambios de forma idempotente.
+    """
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    read_started = datetime.now(timezone.utc)
+
+    users = _changed(USERS_COLL, "updatedAt", since)
+    roles = _changed(ROLES_COLL, "updatedAt", since)
+    deleted = [
+        {"uid": uid, "deletedAt": t.get("deletedAt"), "roles": t.get("roles"), "admin_careers": t.get("admin_careers") or []}
+        for uid, t in _changed(TOMBSTONES_COLL, "deletedAt", since).items()
+    ]
+
+    # Completar el lado que no cambió para devolver filas ya unidas
+    missing_roles = [uid for uid in users if uid not in roles]
+    if missing_roles:
+        refs = [firestore_db.collection(ROLES_COLL).document(uid) for uid in missing_roles]
+        roles.update({s.id: (s.to_dict() or {}) for s in firestore_db.get_all(refs) if s.exists})
+    missing_users = [uid for uid in roles if uid not in users]
+    if missing_users:
+        refs = [firestore_db.collection(USERS_COLL).document(uid) for uid in missing_users]
+        users.update({s.id: (s.to_dict() or {}) for s in firestore_db.get_all(refs) if s.exists})
+
+    rows = []
+    for uid, prof in users.items():
+        prof["uid"] = uid
+        rows.append((uid, prof, roles.get(uid, {"roles": ["student"], "admin_careers": []})))
+
+    watermark = max(since, read_started - timedelta(seconds=SYNC_OVERLAP_SECONDS))
+    return rows, deleted, watermark
+
+def backfill_updated_at(batch_size: int = 400) -> Dict[str, int]:
+    """
+    Pone `updatedAt` en los docs de `users`/`roles` que no lo tienen (la range query de
+    changes_since no los ve). Quedan como cambiados ahora: los clientes los reciben en
+    el próximo sync. Idempotente.
+    """
+    stats: Dict[str, int] = {}
+    for coll in (USERS_COLL, ROLES_COLL):
+        updated = 0
+        batch = firestore_db.batch()
+        pending = 0
+        for d in firestore_db.collection(coll).select(["updatedAt"]).stream():
+            if (d.to_dict() or {}).get("updatedAt") is not None:
+                continue
+            batch.set(
+                firestore_db.collection(coll).document(d.id),
+                {"updatedAt": firestore.SERVER_TIMESTAMP},
+                merge=True,
+            )
+            updated += 1
+            pending += 1
+            if pending >= batch_size:
+                batch.commit()
+                batch = firestore_db.batch()
+                pending = 0
+        if pending:
+            batch.commit()
+        stats[coll] = updated
+    return stats
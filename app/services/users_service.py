@@ -1,27 +1,227 @@
 from app.core.firebase import firestore_db
-from typing import Optional, Dict
+from typing import Callable, Optional, Dict, Iterator, List, Tuple
 from google.cloud import firestore
+from app.config import CACHE_FINGERPRINT_TTL_SECONDS, EXPORT_CHUNK_SIZE
+from app.core.cache import LocalCache, invalidation_count, profile_cache
+from app.services import principals_service
+from app.services.roles_service import ROLES_COLL
+import logging
+
+logger = logging.getLogger(__name__)
 
 COLLECTION = "users"  # <-- importante
 
+# Campos normalizados (minúsculas) para búsqueda por prefijo con range queries
+SEARCH_FIELDS = {"email": "emailLower", "displayName": "displayNameLower"}
+
+def with_search_fields(data: Dict) -> Dict:
+    """
+    Agrega emailLower/displayNameLower para los campos presentes en `data`.
+    """
+    out = dict(data)
+    for src, dst in SEARCH_FIELDS.items():
+        if src in data:
+            out[dst] = (data.get(src) or "").strip().lower() or None
+    return out
+
+def _sync_principal(uid: str, profile: Optional[Dict]) -> None:
+    profile_cache.invalidate(uid)
+    # La vista `principals` es derivada: si falla, se repara con rebuild_principals
+    try:
+        if profile is None:
+            principals_service.clear_profile(uid)
+        else:
+            principals_service.sync_profile(uid, profile)
+    except Exception as e:
+        logger.warning("sync principal (perfil) falló para %s: %s", uid, e)
+
 def upsert_profile(uid: str, data: Dict) -> Dict:
     ref = firestore_db.collection(COLLECTION).document(uid)
-    ref.set({**data, "updatedAt": firestore.SERVER_TIMESTAMP}, merge=True)
-    return ref.get().to_dict()
+    ref.set({**with_search_fields(data), "updatedAt": firestore.SERVER_TIMESTAMP}, merge=True)
+    profile = ref.get().to_dict()
+    _sync_principal(uid, profile or {})
+    return profile
 
-def get_profile(uid: str) -> Optional[Dict]:
+def _load_profile(uid: str) -> Optional[Dict]:
     doc = firestore_db.collection(COLLECTION).document(uid).get()
     return doc.to_dict() if doc.exists else None
 
+def get_profile(uid: str) -> Optional[Dict]:
+    # Un perfil inexistente (None) no se cachea
+    return profile_cache.get_or_load(uid, lambda: _load_profile(uid))
+
 def delete_profile(uid: str) -> None:
-    firestore_db.collection(COLLECTION).document(uid).delete()
+    # Import diferido: sync_service importa este módulo
+    from app.services.sync_service import TOMBSTONES_COLL, tombstone_payload
+    roles_snap = firestore_db.collection(ROLES_COLL).document(uid).get()
+    roles_doc = (roles_snap.to_dict() or {}) if roles_snap.exists else {}
+    # Borrado + tombstone en un commit: /users/changes lo informa como cualquier baja
+    batch = firestore_db.batch()
+    batch.delete(firestore_db.collection(COLLECTION).document(uid))
+    batch.set(firestore_db.collection(TOMBSTONES_COLL).document(uid), tombstone_payload(uid, roles_doc))
+    batch.commit()
+    _sync_principal(uid, None)
 
 def best_effort_materialize(uid: str, base: Dict) -> None:
     try:
         firestore_db.collection(COLLECTION).document(uid).set(
-            {**base, "updatedAt": firestore.SERVER_TIMESTAMP},
+            {**with_search_fields(base), "updatedAt": firestore.SERVER_TIMESTAMP},
             merge=True
         )
     except Exception as e:
         # Evita silenciar por completo, deja al menos un log para depurar:
         print(f"[WARN] best_effort_materialize failed for {uid}: {e}")
+        return
+    _sync_principal(uid, base)
+
+# Campos que el login toma del IdP; si el perfil ya los tiene iguales no se escribe
+LOGIN_SYNC_FIELDS = ("email", "displayName", "photoURL")
+
+def materialize_on_login(uid: str, base: Dict) -> bool:
+    """
+    best_effort_materialize solo si hace falta: sin perfil, o con algún campo del IdP
+    distinto. Un perfil ya provisionado (p.ej. por import) no cuesta escrituras.
+    Devuelve True si escribió.
+    """
+    try:
+        current = get_profile(uid)
+    except Exception as e:
+        logger.warning("get_profile falló en login para %s: %s", uid, e)
+        current = None
+    def _same(k: str) -> bool:
+        new, old = base.get(k), current.get(k)
+        if new in (None, ""):
+            return True
+        if k == "email":
+            return (old or "").lower() == new.lower()
+        return old == new
+
+    if current is not None and all(_same(k) for k in LOGIN_SYNC_FIELDS):
+        return False
+    best_effort_materialize(uid, base)
+    return True
+
+def iter_user_pages(chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[List[Tuple[str, Dict, Dict]]]:
+    """
+    Recorre `users` por páginas (orden por id) y trae los `roles` de cada página con un
+    solo get_all. Produce listas de (uid, perfil, doc de roles); memoria acotada a una página.
+    """
+    query = firestore_db.collection(COLLECTION).order_by("__name__").limit(chunk_size)
+    last = None
+    while True:
+        page_query = query.start_after(last) if last is not None else query
+        docs = list(page_query.stream())
+        if not docs:
+            return
+        refs = [firestore_db.collection(ROLES_COLL).document(d.id) for d in docs]
+        roles_map = {s.id: (s.to_dict() or {}) for s in firestore_db.get_all(refs) if s.exists}
+        page = []
+        for d in docs:
+            prof = d.to_dict() or {}
+            prof["uid"] = d.id
+            page.append((d.id, prof, roles_map.get(d.id, {"roles": ["student"], "admin_careers": []})))
+        yield page
+        if len(docs) < chunk_size:
+            return
+        last = docs[-1]
+
+def search_users(
+    q: str,
+    limit: int = 20,
+    accept: Optional[Callable[[str, Dict, Dict], bool]] = None,
+) -> List[Tuple[str, Dict, Dict]]:
+    """
+    Busca por prefijo de email o displayName (sin distinguir mayúsculas) usando
+    range queries sobre los campos normalizados. Devuelve hasta `limit` tuplas
+    (uid, perfil, doc de roles), primero los matches por email.
+
+    `accept` filtra antes de contar (p.ej. visibilidad del solicitante): se sigue
+    paginando cada campo hasta juntar `limit` aceptados o agotar los matches.
+    """
+    prefix = (q or "").strip().lower()
+    if not prefix:
+        return []
+    found: Dict[str, Tuple[Dict, Dict]] = {}
+    seen: set = set()
+    for field in SEARCH_FIELDS.values():
+        query = (
+            firestore_db.collection(COLLECTION)
+            .where(filter=firestore.FieldFilter(field, ">=", prefix))
+            .where(filter=firestore.FieldFilter(field, "<", prefix + "\uf8ff"))
+            .order_by(field)
+            .limit(limit)
+        )
+        last = None
+        while len(found) < limit:
+            page_query = query.start_after(last) if last is not None else query
+            docs = list(page_query.stream())
+            new = [d for d in docs if d.id not in seen]
+            seen.update(d.id for d in new)
+            if new:
+                refs = [firestore_db.collection(ROLES_COLL).document(d.id) for d in new]
+                roles_map = {s.id: (s.to_dict() or {}) for s in firestore_db.get_all(refs) if s.exists}
+                for d in new:
+                    prof = d.to_dict() or {}
+                    prof["uid"] = d.id
+                    rdoc = roles_map.get(d.id, {"roles": ["student"], "admin_careers": []})
+                    if accept is None or accept(d.id, prof, rdoc):
+                        found[d.id] = (prof, rdoc)
+            if len(docs) < limit:
+                break
+            last = docs[-1]
+    return [(uid, prof, rdoc) for uid, (prof, rdoc) in found.items()][:limit]
+
+def backfill_search_fields(batch_size: int = 400) -> int:
+    """
+    Completa emailLower/displayNameLower en los perfiles existentes. Idempotente.
+    """
+    updated = 0
+    batch = firestore_db.batch()
+    pending = 0
+    for d in firestore_db.collection(COLLECTION).stream():
+        data = d.to_dict() or {}
+        fields = {k: v for k, v in with_search_fields(data).items() if k in SEARCH_FIELDS.values()}
+        if all(data.get(k) == v for k, v in fields.items()):
+            continue
+        batch.set(firestore_db.collection(COLLECTION).document(d.id), fields, merge=True)
+        updated += 1
+        pending += 1
+        if pending >= batch_size:
+            batch.commit()
+            batch = firestore_db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    return updated
+
+def collection_fingerprint(coll: str, field: str = "updatedAt") -> Tuple[int, Optional[str]]:
+    """
+    (cantidad de docs, `field` máximo) de una colección con dos queries baratas
+    (agregación count + 1 doc), sin leer la colección completa.
+    """
+    ref = firestore_db.collection(coll)
+    count = ref.count().get()[0][0].value
+    latest = None
+    for d in ref.order_by(field, direction=firestore.Query.DESCENDING).limit(1).stream():
+        ts = (d.to_dict() or {}).get(field)
+        latest = ts.isoformat() if ts is not None else None
+    return int(count), latest
+
+# (coll, field) -> (invalidation_count al leer, fingerprint)
+_fingerprints = LocalCache(max_entries=16)
+
+def cached_collection_fingerprint(coll: str, field: str = "updatedAt") -> Tuple[int, Optional[str]]:
+    """
+    collection_fingerprint reusado por CACHE_FINGERPRINT_TTL_SECONDS mientras este proceso
+    no vea invalidaciones; un cambio sin invalidación (otro worker sin L2, scripts) se
+    refleja al vencer el TTL.
+    """
+    key = f"{coll}:{field}"
+    gen = invalidation_count()
+    hit = _fingerprints.get(key)
+    if hit is not None and hit[0] == gen:
+        return hit[1]
+    fingerprint = collection_fingerprint(coll, field)
+    if invalidation_count() == gen:
+        _fingerprints.set(key, (gen, fingerprint), CACHE_FINGERPRINT_TTL_SECONDS)
+    return fingerprint
@@ -0,0 +1,77 @@
+import time
+
+from app.core.cache import FakeSharedStore, TTLMarks, TwoLevelCache, TOMBSTONE, invalidation_count
+
+
+def _worker(store: FakeSharedStore) -> TwoLevelCache:
+    # Un "worker": su propia L1, L2 compartida y suscripción a invalidaciones
+    cache = TwoLevelCache("roles", store, l1_ttl=30, l2_ttl=300)
+    store.subscribe(lambda msg: cache._bump(msg.partition(":")[2]))
+    return cache
+
+
+def test_invalidate_during_load_does_not_cache_stale_value():
+    store = FakeSharedStore()
+    cache = _worker(store)
+
+    def slow_loader():
+        # Mientras se lee el doc viejo, otro request revoca el rol
+        cache.invalidate("u1")
+        return {"platform_admin": True}
+
+    assert cache.get_or_load("u1", slow_loader) == {"platform_admin": True}
+    assert cache.get("u1") is None
+    assert store.get("roles:u1") == TOMBSTONE
+    assert cache.get_or_load("u1", lambda: {"platform_admin": False}) == {"platform_admin": False}
+
+
+def test_invalidation_reaches_other_workers():
+    store = FakeSharedStore()
+    a, b = _worker(store), _worker(store)
+
+    assert b.get_or_load("u1", lambda: {"platform_admin": True}) == {"platform_admin": True}
+    a.invalidate("u1")
+
+    assert b.get("u1") is None
+    assert b.get_or_load("u1", lambda: {"platform_admin": False}) == {"platform_admin": False}
+
+
+def test_slow_reader_on_other_worker_cannot_repopulate_l2():
+    store = FakeSharedStore()
+    a, b = _worker(store), _worker(store)
+
+    def loader_started_before_write():
+        a.invalidate("u1")
+        return {"platform_admin": True}
+
+    b.get_or_load("u1", loader_started_before_write)
+
+    assert store.get("roles:u1") == TOMBSTONE
+    assert a.get("u1") is None
+    assert b.get("u1") is None
+
+
+def test_ttl_marks_keep_requested_ttl():
+    store = FakeSharedStore()
+    marks = TTLMarks("session_renew", store)
+    marks.set("u1", 300)
+
+    local_expires = marks.local._data["u1"][0] - time.monotonic()
+    shared_expires = store._data["session_renew:u1"][0] - time.monotonic()
+    assert 290 < local_expires <= 300
+    assert 290 < shared_expires <= 300
+    # Otro worker (L1 vacía) ve la marca por el store compartido
+    assert TTLMarks("session_renew", store).is_set("u1")
+
+
+def test_invalidation_count_sees_local_and_remote_invalidations():
+    store = FakeSharedStore()
+    a, b = _worker(store), _worker(store)
+    before = invalidation_count()
+
+    a.invalidate("u1")
+    # Local en `a` + la recibida por pub/sub en ambos workers
+    assert invalidation_count() > before
+    after_a = invalidation_count()
+    b.invalidate("u2")
+    assert invalidation_count() > after_a
@@ -0,0 +1,152 @@
+import base64
+import datetime
+import json
+import time
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from firebase_admin import auth as fb_auth
+from google.auth import crypt
+from google.auth import jwt as google_jwt
+
+from app.core import keys
+from app.core.keys import ID_TOKEN_ISSUER, SESSION_COOKIE_ISSUER, KeyManager
+
+PROJECT = "ucb-test"
+KID = "kid-1"
+
+
+@pytest.fixture(scope="module")
+def signing_key():
+    # Clave RSA y certificado autofirmado locales (el formato que publica Google: kid -> PEM)
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "securetoken.test")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    key_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    return key_pem, cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+@pytest.fixture
+def manager(monkeypatch, signing_key):
+    monkeypatch.setattr(keys, "FIREBASE_PROJECT_ID", PROJECT)
+    monkeypatch.setattr(keys, "KEY_MANAGER_ENABLED", True)
+    monkeypatch.delenv("FIREBASE_AUTH_EMULATOR_HOST", raising=False)
+    km = KeyManager()
+    km.id_token_keys.certs = {KID: signing_key[1]}
+    km.session_keys.certs = {KID: signing_key[1]}
+    return km
+
+
+def _claims(issuer_prefix: str, **overrides) -> dict:
+    now = int(time.time())
+    claims = {
+        "iss": issuer_prefix + PROJECT,
+        "aud": PROJECT,
+        "sub": "u1",
+        "iat": now - 10,
+        "exp": now + 3600,
+        "auth_time": now - 10,
+    }
+    claims.update(overrides)
+    return claims
+
+
+def _sign(signing_key, claims: dict, kid: str = KID) -> str:
+    signer = crypt.RSASigner.from_string(signing_key[0], key_id=kid)
+    return google_jwt.encode(signer, claims).decode()
+
+
+def _unsigned(header: dict, claims: dict) -> str:
+    def b64(data: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+    return f"{b64(header)}.{b64(claims)}.c2ln"
+
+
+def test_valid_id_token(manager, signing_key):
+    claims = manager.verify_id_token(_sign(signing_key, _claims(ID_TOKEN_ISSUER)))
+    assert claims["uid"] == "u1"
+    assert manager.stats["fallbacks"] == 0
+
+
+def test_valid_session_cookie(manager, signing_key):
+    claims = manager.verify_session_cookie(_sign(signing_key, _claims(SESSION_COOKIE_ISSUER)))
+    assert claims["uid"] == "u1"
+
+
+def test_issuers_are_not_interchangeable(manager, signing_key):
+    # Una session cookie no sirve como ID token ni viceversa
+    with pytest.raises(fb_auth.InvalidIdTokenError):
+        manager.verify_id_token(_sign(signing_key, _claims(SESSION_COOKIE_ISSUER)))
+    with pytest.raises(fb_auth.InvalidSessionCookieError):
+        manager.verify_session_cookie(_sign(signing_key, _claims(ID_TOKEN_ISSUER)))
+
+
+@pytest.mark.parametrize("overrides", [
+    {"aud": "otro-proyecto"},
+    {"iss": ID_TOKEN_ISSUER + "otro-proyecto"},
+    {"sub": ""},
+])
+def test_wrong_claims_rejected(manager, signing_key, overrides):
+    with pytest.raises(fb_auth.InvalidIdTokenError):
+        manager.verify_id_token(_sign(signing_key, _claims(ID_TOKEN_ISSUER, **overrides)))
+
+
+@pytest.mark.parametrize("alg", ["none", "HS256"])
+def test_non_rs256_alg_rejected(manager, alg):
+    token = _unsigned({"alg": alg, "kid": KID, "typ": "JWT"}, _claims(ID_TOKEN_ISSUER))
+    with pytest.raises(fb_auth.InvalidIdTokenError, match="RS256"):
+        manager.verify_id_token(token)
+
+
+def test_bad_signature_rejected(manager):
+    token = _unsigned({"alg": "RS256", "kid": KID, "typ": "JWT"}, _claims(ID_TOKEN_ISSUER))
+    with pytest.raises(fb_auth.InvalidIdTokenError):
+        manager.verify_id_token(token)
+
+
+def test_unknown_kid_rejected_and_schedules_refresh(manager, signing_key):
+    token = _sign(signing_key, _claims(ID_TOKEN_ISSUER), kid="kid-nuevo")
+    with pytest.raises(fb_auth.InvalidIdTokenError, match="kid"):
+        manager.verify_id_token(token)
+    # El request no espera la descarga: solo despierta al thread de refresh
+    assert manager._wake.is_set()
+
+    # Un segundo kid desconocido dentro del intervalo no fuerza otro refresh
+    manager._wake.clear()
+    with pytest.raises(fb_auth.InvalidIdTokenError):
+        manager.verify_id_token(token)
+    assert not manager._wake.is_set()
+
+
+def test_expired_tokens(manager, signing_key):
+    now = int(time.time())
+    expired = {"iat": now - 7200, "exp": now - 3600}
+    with pytest.raises(fb_auth.ExpiredIdTokenError):
+        manager.verify_id_token(_sign(signing_key, _claims(ID_TOKEN_ISSUER, **expired)))
+    with pytest.raises(fb_auth.ExpiredSessionCookieError):
+        manager.verify_session_cookie(_sign(signing_key, _claims(SESSION_COOKIE_ISSUER, **expired)))
+
+
+def test_clock_skew_tolerance(manager, signing_key):
+    # iat unos segundos en el futuro (reloj del servidor atrasado)
+    token = _sign(signing_key, _claims(SESSION_COOKIE_ISSUER, iat=int(time.time()) + 30))
+    with pytest.raises(fb_auth.InvalidSessionCookieError, match="too early"):
+        manager.verify_session_cookie(token)
+    assert manager.verify_session_cookie(token, clock_skew_seconds=60)["uid"] == "u1"